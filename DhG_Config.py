@@ -20,6 +20,8 @@
 import os
 import re
 
+from DhG_Date import Date
+
 # A class to hold the configuration for DhG
 #
 # The class only contains static variables and methods.
@@ -31,7 +33,6 @@ class Config():
 	cfgfile = os.path.expanduser('~') + '/.DhG/config'
 
 	config = {}
-	gedmonths = ['XXX', 'JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
 
 	# Initialize the class
 	@staticmethod
@@ -54,6 +55,16 @@ class Config():
 		Config.config['generate'] = 'public'		# Content in generated files: 'public; or 'all'
 		Config.config['text-suffix'] = 'text'		# Colon-separated list of text file suffixes. No dots
 		Config.config['text_path'] = None			# Locations of text transcript files. Colon-separated
+		Config.config['load_jobs'] = 1				# No. of processes for loading the database. 0 = one per CPU
+		Config.config['lazy_load'] = 'n'			# 'y' = read only the vital events at startup
+		Config.config['snapshot_file'] = None		# File for storing the parsed database between sessions
+		Config.config['watch_interval'] = 0			# Seconds between scans for changed card files. 0 = off
+		Config.config['html_jobs'] = 1				# No. of processes for creating HTML cards. 0 = one per CPU
+		Config.config['incremental'] = 'n'			# 'y' = only create HTML files whose content has changed
+		Config.config['skip_unchanged'] = 'n'		# 'y' = don't write files that differ only in the timestamp
+		Config.config['site_descendants'] = None	# File listing the persons for descendant trees in htmlsite
+		Config.config['site_ancestors'] = None		# File listing the persons for ancestor trees in htmlsite
+		Config.config['bytecode_cache'] = None		# Directory for storing compiled templates between sessions
 
 		Config.ReadConfig()
 		if Config.config['db_dir'] == None:
@@ -81,8 +92,8 @@ class Config():
 		if lcvar == 'cfgfile':
 			print('Error: the value of the cfgfile variable cannot be set from within DhG2.')
 			return
-		# Special case: ensure that 'depth' is a number
-		if lcvar == 'depth':
+		# Special case: ensure that 'depth', 'load_jobs', 'watch_interval' and 'html_jobs' are numbers
+		if lcvar == 'depth' or lcvar == 'load_jobs' or lcvar == 'watch_interval' or lcvar == 'html_jobs':
 			try:
 				val = int(val)
 			except:
@@ -237,12 +248,7 @@ class Config():
 		return path
 
 	# Returns a "normalised" version of a given date according to the specified format
-	#
-	# Date formats are:
-	#	raw      -- exactly as entered
-	#	cooked	 -- approximations rendered as abt, bef and aft, quarters changed to abt <middle month>
-	#	yearonly -- only the year, approxmations ignored if they come after month or day.
-	# Any format not lists above is treated as cooked.
+	# See Date.Format() for the date formats. If fmt is None the configured format is used.
 	#
 	@staticmethod
 	def FormatDate(date, dflt, fmt):
@@ -256,66 +262,7 @@ class Config():
 			# No format specified. Use the default.
 			fmt = Config.Get('dateformat')
 
-		if fmt == 'raw':
-			# Raw format - return the date unmodified.
-			return date
-
-		# Convert and remove the modifier suffix
-		odate = date
-		mod = odate[-1]
-		if mod == '~':
-			mod = 'abt.'
-		elif mod == '<':
-			mod = 'bef.'
-		elif mod == '>':
-			mod = 'aft.'
-		else:
-			mod = ''
-		if mod != '':
-			odate = odate[0:-1]
-			if fmt == 'gedcom':
-				mod = mod[0:3].upper() + ' '
-
-		# Split into YYYY, MM and DD maybe not all present.
-		parts = odate.split('-')
-		if len(parts) <= 1:
-			# Only the year is available. Modifier applies to year
-			return mod+odate
-
-		yy = parts[0]
-		if fmt == 'yearonly':
-			# More than the year is available, but only the year is required. Modifier not applied.
-			return yy
-
-		mm = parts[1]
-		if mm[0].upper() == 'Q':
-			# Convert quarter to middle month of quarter and use 'abt.'
-			qmm = [ '?', '02', '05', '08', '11' ]
-			try:
-				mm = qmm[int(mm[1])]
-			except:
-				pass
-			if fmt == 'gedcom':
-				try:
-					gedmonth = Config.gedmonths[int(mm)]
-				except:
-					gedmonth = Config.gedmonths[0]
-				return 'ABT ' + gedmonth + ' ' + yy
-			return 'abt.' + yy + '-' + mm
-
-		if fmt == 'gedcom':
-			try:
-				gedmonth = Config.gedmonths[int(mm)]
-			except:
-				gedmonth = Config.gedmonths[0]
-			if len(parts) <= 2:
-				dd = ''
-			else:
-				dd = parts[2] + ' '
-			return mod + dd + gedmonth + ' ' + yy
-
-		# Nothing else specified. Return "raw" date but with standardised modifier as prefix
-		return mod+odate
+		return Date.Get(date).Format(fmt)
 
 	# Find a file called fname in a list of locations given by cfgvar.
 	# If cfgvar is not given or has no value, dflt is used instead.
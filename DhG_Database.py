@@ -19,13 +19,99 @@
 
 import os
 import sys
+import io
+import contextlib
+import multiprocessing
+import time
+import functools
 from pathlib import Path
 from DhG_Config import Config
+from DhG_Date import Date
 from DhG_Person import Person
-from DhG_Template import T_Person, T_Descendants, T_AncestorNode, T_IndexList
-from DhG_Event import TEventFactory
+from DhG_Template import T_Person, T_Descendants, T_DescendantsView, T_AncestorNode, T_IndexList
+from DhG_Event import Event, TEventFactory
 from DhG_GedcomImporter import GedcomImporter
 from DhG_GedcomExporter import GedcomExporter
+from DhG_Snapshot import Snapshot
+from DhG_Relations import Relations
+from DhG_NameIndex import NameIndex
+
+# Read and analyse a single card file. Used by the worker processes of a parallel load and when
+# updating the snapshot.
+#
+# Returns a tuple containing the path, the person's record (None if the card has no unique ID) and
+# the text of any messages that were printed during the analysis. The messages are returned rather
+# than printed so that the main process can print them in the same order as a serial load.
+# If lazy is True, only the information needed for the header and vital events is read.
+#
+def ParseCard(path, lazy=False):
+	msgs = io.StringIO()
+	with contextlib.redirect_stdout(msgs):
+		p = Person()
+		p.ReadFile(path, lazy)
+		p.AnalyseHeader()
+		if p.uniq == None:
+			rec = None
+		else:
+			p.AnalyseEvents()
+			rec = p.GetRecord()
+	return (path, rec, msgs.getvalue())
+
+# Initialise a worker process for ParseCard() or LintCard() with the configuration of the main process.
+# Depending on the platform, a worker might be started without a copy of the main process's memory.
+#
+def InitWorker(config):
+	Config.config = config
+	return
+
+# Check the structure of a single card file without adding it to the database. Used by Database.Lint(),
+# possibly in a worker process.
+#
+# The checks are those made when the card is loaded and when its HTML card is created: the header lines,
+# the form of the event lines and the information items and sources within the events.
+# Returns a list of (path, line, problem) tuples, where line is the line number in the card file.
+# A card file that can't be read is reported as a problem at line 0.
+#
+def LintCard(path):
+	problems = []
+	p = Person()
+	try:
+		with contextlib.redirect_stdout(io.StringIO()):
+			p.ReadFile(path)
+	except (OSError, UnicodeDecodeError) as ex:
+		return [(str(path), 0, 'Card file cannot be read: '+str(ex))]
+
+	header = []
+	p.AnalyseHeader(header)
+	for (index, msg) in header:
+		problems.append((str(path), index+1, msg))
+	if p.name == None:
+		problems.append((str(path), 1, 'No name'))
+	if p.uniq == None:
+		problems.append((str(path), 1, 'No unique ID'))
+
+	for e in p.event_list:
+		parts = e.lines[0].split(maxsplit=2)
+		if len(parts) < 2:
+			problems.append((str(path), e.lineno, 'Insufficient fields in event date line "'+e.lines[0]+'"'))
+			continue
+		for (index, line) in enumerate(e.lines):
+			msg = Event.CheckLine(line)
+			if index > 0 and msg != None:
+				problems.append((str(path), e.lineno+index, msg))
+		try:
+			model = e.GetModel()
+		except Exception as ex:
+			problems.append((str(path), e.lineno, 'Event cannot be analysed: '+repr(ex)))
+			continue
+		for item in model:
+			entries = [item]
+			if item[0] == 'source':
+				entries += item[3]
+			for entry in entries:
+				if entry[0] == 'warning':
+					problems.append((str(path), e.lineno+entry[1], entry[2]))
+	return problems
 
 # A class to represent the entire database
 #
@@ -38,6 +124,12 @@ class Database:
 		self.persons = []
 		self.basepath = basepath
 		self.mf = {}				# Male or female per name
+		self.cards = {}				# (signature, uniq) for each card file loaded, indexed by file name
+		self.relations = Relations()	# Index of the relationships between the persons
+		self.names = NameIndex()		# Index of the names of the persons
+		self.tpersons = {}				# Shared T_Person objects: uniq --> {dateformat: T_Person}
+		self.desc_cache = None			# Descendant subtrees while the descendant cache is active
+		Person.reload_handler = self.ReloadStale
 
 	# Add a person to the database, after expanding the array to ensure that the entry exists.
 	#
@@ -56,12 +148,142 @@ class Database:
 	def Reload(self):
 		self.persons = []
 		self.mf = {}
-		for path in Path(self.basepath).rglob('*.card'):
-			self.LoadPerson(path)
+		self.cards = {}
+		self.tpersons = {}
+		paths = list(Path(self.basepath).rglob('*.card'))
+		sigs = self.GetSignatures(paths)
+		snapshot = self.OpenSnapshot()
+		for (path, rec, msgs) in self.ParseCards(paths, sigs, snapshot):
+			p = self.AddRecord(path, rec, msgs)
+			self.NoteCard(path, sigs[str(path)], p)
+		if snapshot != None:
+			snapshot.Save()
+		self.relations.Build(self.persons)
+		self.names.Build(self.persons)
 		self.VerifyRefs()
 		self.MFGuess()
 		return
 
+	# Reload only the card files that have been added, modified or deleted since the last load.
+	# Modified and new cards are parsed again and persons whose card files have gone are removed.
+	# Then the references of the affected persons and their relatives are verified.
+	#
+	# The signatures of the card files can be supplied by the caller (see Watcher), otherwise the
+	# database directory is scanned. If quiet is True, the summary is only printed if anything changed.
+	#
+	def ReloadChanged(self, sigs = None, quiet = False):
+		t0 = time.time()
+		if sigs == None:
+			paths = list(Path(self.basepath).rglob('*.card'))
+			sigs = self.GetSignatures(paths)
+		else:
+			paths = [Path(key) for key in sigs]
+
+		added = []
+		modified = []
+		for path in paths:
+			key = str(path)
+			if key not in self.cards:
+				added.append(path)
+			elif self.cards[key][0] != sigs[key]:
+				modified.append(path)
+		removed = [key for key in self.cards if key not in sigs]
+
+		# Remove the persons whose card files have gone or changed
+		affected = set()
+		privacy = set()
+		for key in removed + [str(path) for path in modified]:
+			uniq = self.cards.pop(key)[1]
+			if uniq != None and uniq < len(self.persons):
+				p = self.persons[uniq]
+				if p != None and str(p.filename) == key:
+					privacy |= self.GetPrivacyDependants(p)
+					self.UnindexPerson(p)
+					self.persons[uniq] = None
+					affected.add(uniq)
+
+		# Other cards with the unique ID of a removed person were rejected as duplicates when they
+		# were loaded. They are parsed again so that one of them can take the person's place.
+		reparse = modified + added
+		for (key, (sig, uniq)) in list(self.cards.items()):
+			if uniq in affected and key in sigs:
+				del self.cards[key]
+				reparse.append(Path(key))
+
+		# Parse the new and changed card files and add them to the database
+		new_persons = []
+		snapshot = self.OpenSnapshot()
+		for (path, rec, msgs) in self.ParseCards(reparse, sigs, snapshot):
+			p = self.AddRecord(path, rec, msgs)
+			self.NoteCard(path, sigs[str(path)], p)
+			if p != None:
+				self.IndexPerson(p)
+				new_persons.append(p)
+				affected.add(p.uniq)
+		for p in new_persons:
+			privacy |= self.GetPrivacyDependants(p)
+		self.ClearPrivacy(privacy)
+
+		# Keep the snapshot up to date with the cards that are now loaded
+		if snapshot != None:
+			for key in self.cards:
+				snapshot.Lookup(key, self.cards[key][0])
+			snapshot.Save()
+
+		self.VerifyRefs(self.GetRelatives(affected))
+		self.MFGuess()
+		if quiet and len(added) + len(modified) + len(removed) == 0:
+			return
+		print('Reload:', len(added), 'added,', len(modified), 'modified,', len(removed), 'removed',
+				'(%.2f seconds)' % (time.time() - t0))
+		return
+
+	# Return the snapshot of the parsed cards after reading the snapshot file, or None if no snapshot
+	# file is configured
+	#
+	def OpenSnapshot(self):
+		if Config.Get('snapshot_file') == None:
+			return None
+		snapshot = Snapshot(Config.Get('snapshot_file'), (str(self.basepath), Config.Get('lazy_load')))
+		snapshot.Load()
+		return snapshot
+
+	# Return a dictionary containing the signature of each file in a list (see Snapshot.GetSignature()).
+	# The dictionary is indexed by the file name as a string. Files that can't be accessed have None.
+	#
+	def GetSignatures(self, paths):
+		sigs = {}
+		for path in paths:
+			try:
+				sigs[str(path)] = Snapshot.GetSignature(path)
+			except OSError:
+				sigs[str(path)] = None
+		return sigs
+
+	# Return the signatures of the card files that have been loaded, indexed by file name
+	#
+	def GetCardSignatures(self):
+		sigs = {}
+		for key in self.cards:
+			sigs[key] = self.cards[key][0]
+		return sigs
+
+	# Record the signature of a card file and the person that was loaded from it (None if none).
+	# If the signature is not given, the file is examined.
+	#
+	def NoteCard(self, path, sig, p):
+		if sig == None:
+			try:
+				sig = Snapshot.GetSignature(path)
+			except OSError:
+				pass
+		if p == None:
+			self.cards[str(path)] = (sig, None)
+		else:
+			self.cards[str(path)] = (sig, p.uniq)
+			p.signature = sig
+		return
+
 	# Load a new person
 	#
 	def LoadPerson(self, path):
@@ -70,13 +292,103 @@ class Database:
 		p.AnalyseHeader()
 		if p.uniq == None:
 			print(path, ': no unique ID')
+			self.NoteCard(path, None, None)
 			return 1
 		else:
 			self.AddPerson(p.uniq, p)
 			p.AnalyseEvents()
+			self.IndexPerson(p)
+			self.NoteCard(path, None, p)
 		return 0
 
-	# Reload an individual card
+	# Add a person to the relationship and name indexes, but only if the person is the one that is stored
+	# in the database under its unique ID. Any T_Person objects for the unique ID are discarded.
+	#
+	def IndexPerson(self, p):
+		if self.persons[p.uniq] is p:
+			self.relations.Add(p)
+			self.names.Add(p)
+			self.tpersons.pop(p.uniq, None)
+		return
+
+	# Remove a person from the relationship and name indexes and discard the person's T_Person objects
+	#
+	def UnindexPerson(self, p):
+		self.relations.Remove(p)
+		self.names.Remove(p)
+		self.tpersons.pop(p.uniq, None)
+		return
+
+	# Parse a list of card files.
+	# Returns a list of (path, rec, msgs) tuples (see ParseCard()) in the same order as the paths.
+	# Cards that are unchanged since the snapshot was made are taken from the snapshot. The others are
+	# parsed, using a pool of worker processes if configured, and stored in the snapshot.
+	# If the lazy_load configuration variable is 'y', the events are only partially parsed.
+	#
+	def ParseCards(self, paths, sigs, snapshot=None):
+		parsed = []
+		todo = []
+		for path in paths:
+			entry = None
+			if snapshot != None:
+				entry = snapshot.Lookup(path, sigs[str(path)])
+			if entry == None:
+				todo.append(len(parsed))
+			parsed.append(entry)
+
+		todo_paths = [paths[i] for i in todo]
+		parse = functools.partial(ParseCard, lazy = (Config.Get('lazy_load') == 'y'))
+		results = self.MapCards(parse, todo_paths)
+
+		for (i, entry) in zip(todo, results):
+			parsed[i] = entry
+			if snapshot != None:
+				(path, rec, msgs) = entry
+				snapshot.Store(path, sigs[str(path)], rec, msgs)
+		return parsed
+
+	# Apply a function to a list of card paths, using a pool of load_jobs worker processes if
+	# configured (0 means one per CPU). Each worker is given the configuration (see InitWorker()).
+	# Returns the results in the order of the paths.
+	#
+	def MapCards(self, func, paths):
+		jobs = Config.Get('load_jobs')
+		if jobs == 0:
+			jobs = os.cpu_count()
+		if jobs == None or jobs <= 1 or len(paths) <= 1:
+			return list(map(func, paths))
+		chunksize = max(1, len(paths) // (jobs * 8))
+		with multiprocessing.Pool(jobs, InitWorker, (Config.config,)) as pool:
+			return pool.map(func, paths, chunksize)
+
+	# Add a parsed card to the database, printing the messages from the parsing.
+	# Returns the new Person object, or None if the card has no unique ID.
+	#
+	def AddRecord(self, path, rec, msgs):
+		if msgs != '':
+			print(msgs, end='')
+		if rec == None:
+			print(path, ': no unique ID')
+			return None
+		p = Person.FromRecord(rec)
+		self.AddPerson(p.uniq, p)
+		return p
+
+	# Check the structure of all the card files in the database directory (see LintCard()).
+	# The cards are read again from the files, using a pool of worker processes if configured.
+	# Returns a list of (path, line, problem) tuples sorted by path and line.
+	#
+	def Lint(self):
+		paths = list(Path(self.basepath).rglob('*.card'))
+		results = self.MapCards(LintCard, paths)
+		problems = []
+		for r in results:
+			problems += r
+		problems.sort()
+		return problems
+
+	# Reload an individual card.
+	# The references of the reloaded person and of the persons that refer to it are verified again.
 	#
 	def ReloadPerson(self, uniq):
 		filename = self.persons[uniq].filename
@@ -88,24 +400,70 @@ class Database:
 			print(os.path.basename(filename), ': unique ID no longer present. Correct the error and reload')
 		elif p.uniq == uniq:
 			# Editing has not changed the unique ID
+			privacy = self.GetPrivacyDependants(self.persons[uniq])
+			self.UnindexPerson(self.persons[uniq])
 			self.persons[uniq] = p
 			p.AnalyseEvents()
+			self.IndexPerson(p)
+			self.NoteCard(filename, None, p)
+			self.ClearPrivacy(privacy | self.GetPrivacyDependants(p))
+			self.VerifyRefs(self.GetRelatives({uniq}))
 		else:
 			print(os.path.basename(filename), ': unique ID has changed. You should rename the file and reload')
 			self.AddPerson(p.uniq, p)
 			p.AnalyseEvents()
+			self.IndexPerson(p)
+			self.NoteCard(filename, None, p)
+			if self.persons[p.uniq] is p:
+				self.ClearPrivacy(self.GetPrivacyDependants(p))
+				self.VerifyRefs(self.GetRelatives({p.uniq}))
 		return
 
-	# Clear the calculated privacy of every person in the database
+	# Reload a lazily-loaded person whose card file has changed since it was read (see Person.LoadEvents()).
+	# Nothing is reloaded if the person has already been replaced in the database.
+	# Returns the person now stored in the database for the card file, or None if there isn't one.
 	#
-	def ClearPrivacy(self):
-		for p in filter(lambda x: x != None, self.persons):
-			p.calc_privacy = None
+	def ReloadStale(self, p):
+		if p.uniq < len(self.persons) and self.persons[p.uniq] is p:
+			self.ReloadPerson(p.uniq)
+		if p.uniq < len(self.persons):
+			q = self.persons[p.uniq]
+			if q != None and q is not p and q.filename == p.filename:
+				return q
+		return None
+
+	# Return a list of the persons whose references might be affected by changes to a set of persons:
+	# the persons themselves and all persons that refer to them as parent or spouse.
+	# The list is in order of unique ID.
+	#
+	def GetRelatives(self, uniqs):
+		rel = set()
+		for uniq in uniqs:
+			if uniq < len(self.persons) and self.persons[uniq] != None:
+				rel.add(uniq)
+			rel.update(self.relations.GetChildren(uniq))
+			rel.update(self.relations.GetPartnerRefs(uniq))
+		return [self.persons[uniq] for uniq in sorted(rel)]
+
+	# Clear the calculated privacy of every person in the database, or only of the persons whose
+	# unique IDs are in a given set
+	#
+	def ClearPrivacy(self, uniqs = None):
+		if uniqs == None:
+			for p in filter(lambda x: x != None, self.persons):
+				p.calc_privacy = None
+		else:
+			for uniq in uniqs:
+				if self.persons[uniq] != None:
+					self.persons[uniq].calc_privacy = None
 		return
 
 	# Guess the sex based on existing persons
+	# The guesses are always made again for the whole database. A name that can be male or female is
+	# only reported if it was not already reported by the previous guess.
 	#
 	def MFGuess(self):
+		previous = self.mf
 		self.mf = {}
 		for p in filter(lambda x: x != None, self.persons):
 			if p.sex == 'u':
@@ -116,11 +474,51 @@ class Database:
 					pass
 				else:
 					self.mf[firstname] = '?'
-					print(firstname, 'can be male or female')
+					if previous.get(firstname) != '?':
+						print(firstname, 'can be male or female')
 			except:
 				self.mf[firstname] = p.sex
 		return
 
+	# Print a report of the memory used by the persons in the database.
+	# The size is found by following all the references from each Person object. Shared objects such
+	# as interned strings are counted once. For comparison, an estimate of the size that the same
+	# objects would need if they had attribute dictionaries instead of slots is also shown.
+	#
+	def MemoryReport(self):
+		plain_size = sys.getsizeof(T_IndexList())		# An object with an attribute dictionary
+		seen = set()
+		slotted = 0
+		unslotted = 0
+		n_persons = 0
+		todo = []
+		for p in filter(lambda x: x != None, self.persons):
+			todo.append(p)
+			n_persons += 1
+		while len(todo) > 0:
+			o = todo.pop()
+			if id(o) in seen:
+				continue
+			seen.add(id(o))
+			size = sys.getsizeof(o)
+			slotted += size
+			if isinstance(o, Person) or isinstance(o, Event):
+				values = [getattr(o, name, None) for name in type(o).__slots__]
+				unslotted += plain_size + sys.getsizeof(dict(zip(type(o).__slots__, values)))
+				todo.extend(values)
+			else:
+				unslotted += size
+				if isinstance(o, list) or isinstance(o, tuple):
+					todo.extend(o)
+		if n_persons == 0:
+			print('The database is empty')
+			return
+		print('Memory used by', n_persons, 'persons:')
+		print('   with slots:                  %10d bytes (%d bytes per person)' % (slotted, slotted // n_persons))
+		print('   with attribute dictionaries: %10d bytes (%d bytes per person) (estimated)' %
+					(unslotted, unslotted // n_persons))
+		return
+
 	# Return a list of all the unused entries in the database
 	#
 	def GetUnused(self):
@@ -151,7 +549,12 @@ class Database:
 					return l
 		if name == None:
 			return l
-		for p in filter(lambda x: x != None, self.persons):
+		candidates = self.names.GetCandidates(name.split())
+		if candidates == None:
+			plist = filter(lambda x: x != None, self.persons)
+		else:
+			plist = [self.persons[uniq] for uniq in candidates]
+		for p in plist:
 			if p.IsMatch(name):
 				l.append(p)
 		return l
@@ -166,26 +569,9 @@ class Database:
 		except:
 			return None
 
-		f_uniq = p.father_uniq
-		m_uniq = p.mother_uniq
-
-		if f_uniq == None and m_uniq == None:
-			return []
-
-		if f_uniq == None:
-			f_uniq = -1			# No match with person whose father is unknown or name only
-		if m_uniq == None:
-			m_uniq = -1			# No match with person whose mother is unknown or name only
-
-		sibs = []
-		for pp in filter(lambda x: x != None, self.persons):
-			if pp.father_uniq == f_uniq or pp.mother_uniq == m_uniq:
-				sibs.append((pp.GetDoB(None), pp))
-		sibs_in_order = sorted(sibs, key=lambda xx: xx[0])
-
 		sibs = []
-		for xx in sibs_in_order:
-			sibs.append(xx[1])
+		for (s_uniq, parents) in self.relations.GetSiblings(p):
+			sibs.append(self.persons[s_uniq])
 		return sibs
 
 	# Returns a list of children of a person, in order of data-of-birth
@@ -205,30 +591,24 @@ class Database:
 			return None
 
 		children = []
-		for pp in filter(lambda x: x != None, self.persons):
-			if pp.father_uniq == uniq or pp.mother_uniq == uniq:
-				if other == True:
-					children.append((pp.GetDoB(None), pp))
-				elif other == False:
-					if pp.father_uniq == None or pp.mother_uniq == None:
-						children.append((pp.GetDoB(None), pp))
-				elif pp.father_uniq == other or pp.mother_uniq == other:
-					children.append((pp.GetDoB(None), pp))
-		children_in_order = sorted(children, key=lambda xx: xx[0])
-
-		children = []
-		for xx in children_in_order:
-			children.append(xx[1])
+		for c_uniq in self.relations.GetChildren(uniq):
+			pp = self.persons[c_uniq]
+			if other == True:
+				children.append(pp)
+			elif other == False:
+				if pp.father_uniq == None or pp.mother_uniq == None:
+					children.append(pp)
+			elif pp.father_uniq == other or pp.mother_uniq == other:
+				children.append(pp)
 		return children
 
 	# Return a list of dates and partners for a person, sorted by date
 	#
 	def GetPartners(self, uniq):
-		try:
-			p = self.persons[uniq]
-			return p.GetPartners()
-		except:
+		pp = self.relations.GetPartners(uniq)
+		if len(pp) == 0:
 			return None
+		return [(date, sp_uniq) for (date, sp_uniq, sp_name) in pp]
 
 	# Return a dictionary containing the parents, siblings and children of a person
 	#
@@ -307,9 +687,13 @@ class Database:
 	# Determine whether a person is private by looking at
 	#	* the person
 	#	* the person's partners
-	#	* the person's siblings and their partners
+	#	* the other parents of the person's children
+	#	* the person's siblings, their partners and the other parents of their children
+	#
+	# The relatives are examined up to a depth of three. The relatives of each person are found by
+	# GetPrivacyRelatives() and kept in the neighbours dictionary, which can be shared between calls.
 	#
-	def IsPrivatePerson(self, p, recurse=0):
+	def IsPrivatePerson(self, p, recurse=0, neighbours=None):
 		if p.calc_privacy != None:
 			return p.calc_privacy		# Privacy already calculated; return it
 		if p.IsPrivate():
@@ -319,59 +703,141 @@ class Database:
 		if recurse > 2:
 #			print('Database.IsPrivate(): recurse =', recurse)
 			return False
-		pp = p.GetPartners()			# List of tuples
-		if pp != None:
-			for partner in pp:
-				if self.IsPrivate(partner[1], recurse+1):
-					p.calc_privacy = True
-					return True
-		cc = self.GetChildren(p.uniq)	# List of Person() objects
-		if cc != None:
-			for child in cc:
-				if self.IsPrivate(child.father_uniq, recurse+1):
-					p.calc_privacy = True
-					return True
-				if self.IsPrivate(child.mother_uniq, recurse+1):
-					p.calc_privacy = True
-					return True
-		ss = self.GetSiblings(p.uniq)	# List of Person() objects. Never None
-		for sib in ss:
-			if sib.uniq == p.uniq:
-				continue
-			if self.IsPrivate(sib.uniq, recurse+1):
+		if neighbours == None:
+			neighbours = {}
+		try:
+			rel = neighbours[p.uniq]
+		except KeyError:
+			rel = neighbours[p.uniq] = self.GetPrivacyRelatives(p)
+		for pp in rel:
+			if self.IsPrivatePerson(pp, recurse+1, neighbours):
 				p.calc_privacy = True
 				return True
-			pp = sib.GetPartners()				# List of tuples
-			if pp != None:
-				for partner in pp:
-					if self.IsPrivate(partner[1], recurse+1):
-						p.calc_privacy = True
-						return True
-			cc = self.GetChildren(sib.uniq)		# List of Person() objects
-			if cc != None:
-				for child in cc:
-					if self.IsPrivate(child.father_uniq, recurse+1):
-						p.calc_privacy = True
-						return True
-					if self.IsPrivate(child.mother_uniq, recurse+1):
-						p.calc_privacy = True
-						return True
 		p.calc_privacy = False
 		return False
 
-	# Return a list of T_Descendant objects for a subject given by the person parameter
+	# Return a list of the persons whose privacy affects the privacy of a person, in the order
+	# in which they are examined. Each person appears only once, at the first place it is examined;
+	# examining a person a second time at the same depth can't give a different result.
+	#
+	def GetPrivacyRelatives(self, p):
+		rel = []
+		seen = set()
+
+		def Add(uniq):
+			if uniq != None and uniq not in seen and uniq < len(self.persons) and self.persons[uniq] != None:
+				seen.add(uniq)
+				rel.append(self.persons[uniq])
+
+		def AddFamily(pp):
+			for (date, sp_uniq, sp_name) in self.relations.GetPartners(pp.uniq):
+				Add(sp_uniq)
+			for c_uniq in self.relations.GetChildren(pp.uniq):
+				child = self.persons[c_uniq]
+				Add(child.father_uniq)
+				Add(child.mother_uniq)
+
+		AddFamily(p)
+		for (s_uniq, parents) in self.relations.GetSiblings(p):
+			if s_uniq != p.uniq:
+				Add(s_uniq)
+				AddFamily(self.persons[s_uniq])
+		return rel
+
+	# Return the set of unique IDs of the persons whose calculated privacy might depend on a person,
+	# including the person.
+	#
+	# The privacy of a person depends on the relatives up to three steps away (see IsPrivatePerson()),
+	# and the relatives of a person are found from the partnerships and parents of the person, of the
+	# person's children and of the person's siblings. So the persons whose relatives can be changed by
+	# the person's card are the person, the parents and siblings of the person and the siblings of the
+	# parents. The persons that can reach any of these in three steps are found by following the
+	# relationships backwards.
+	#
+	# The index must contain the person. For an edited card, call this method before removing the old
+	# person from the index and again after adding the new person.
+	#
+	def GetPrivacyDependants(self, p):
+		found = set()
+		for q in [p] + self.GetPersonList([p.father_uniq, p.mother_uniq]):
+			for (s_uniq, parents) in self.relations.GetSiblings(q):
+				found.add(s_uniq)
+			found.add(q.uniq)
+		level = set(found)
+		for i in range(3):
+			next_level = set()
+			for uniq in level:
+				for dep in self.GetPrivacyReferrers(self.persons[uniq]):
+					if dep not in found:
+						found.add(dep)
+						next_level.add(dep)
+			level = next_level
+		return found
+
+	# Return the set of unique IDs of the persons whose relatives (see GetPrivacyRelatives())
+	# include a person. This is the reverse of GetPrivacyRelatives().
+	#
+	def GetPrivacyReferrers(self, p):
+		direct = set(self.relations.GetPartnerRefs(p.uniq))
+		for c_uniq in self.relations.GetChildren(p.uniq):
+			child = self.persons[c_uniq]
+			direct.update(self.GetPersonUniqs([child.father_uniq, child.mother_uniq]))
+		found = set(direct)
+		for q in [p] + self.GetPersonList(direct):
+			for (s_uniq, parents) in self.relations.GetSiblings(q):
+				found.add(s_uniq)
+		return found
+
+	# Return the persons in the database for a list of unique IDs, ignoring the IDs that are None
+	# or don't refer to a person
+	#
+	def GetPersonList(self, uniqs):
+		return [self.persons[uniq] for uniq in self.GetPersonUniqs(uniqs)]
+
+	# Return the unique IDs in a list that refer to persons in the database
+	#
+	def GetPersonUniqs(self, uniqs):
+		return [uniq for uniq in uniqs if uniq != None and uniq < len(self.persons) and self.persons[uniq] != None]
+
+	# Calculate the privacy of every person in the database whose privacy is not already known,
+	# in order of unique ID. The relatives of each person are only found once for the whole database.
+	# Returns the number of private persons, the number of public persons and the time taken.
+	#
+	def CalculatePrivacy(self):
+		t0 = time.time()
+		neighbours = {}
+		n_private = 0
+		n_public = 0
+		for p in filter(lambda x: x != None, self.persons):
+			if self.IsPrivatePerson(p, 0, neighbours):
+				n_private += 1
+			else:
+				n_public += 1
+		return (n_private, n_public, time.time() - t0)
+
+	# Return a list of T_Descendants objects for a subject given by the person parameter
 	# The subj parameter is an existing T_Person for the subject, to avoid duplication
+	# The levels parameter is the number of levels of the tree that may be shown, including the subject's.
 	#
-	def GetTDescendants(self, level, person, subj, dateformat):
-		if level > Config.Get('depth'):
+	# The objects have level 1 for the subject and their children are lists returned by this method,
+	# so they must be placed in the tree with T_DescendantsView. Each subtree is built only once for
+	# each combination of date format, generate mode and number of levels and is then taken from the
+	# cache, both within a tree and, while the descendant cache is active, across trees.
+	#
+	def GetTDescendants(self, levels, person, subj, dateformat, cache):
+		if levels < 1:
 			return []
 
+		key = (person.uniq, dateformat, Config.Get('generate'), levels)
+		try:
+			return cache[key]
+		except KeyError:
+			pass
+
 		tdlist = []
 
 		# Get list of partners from marriage records
-		pp = person.GetPartners()
-		if pp == None:
-			pp = []
+		pp = [(date, sp_uniq) for (date, sp_uniq, sp_name) in self.relations.GetPartners(person.uniq)]
 
 		# Get list of children
 		cc = self.GetChildren(person.uniq)
@@ -398,10 +864,12 @@ class Database:
 				pp.append(t)
 
 		# Re-sort the combined partnerships list
-		pp = sorted(pp, key=lambda xx: xx[0])
+		pp = sorted(pp, key=lambda xx: Date.SortKey(xx[0]))
 
 		if pp == []:
-			return [T_Descendants(level, subj)]
+			tdlist = [T_Descendants(1, subj)]
+			cache[key] = tdlist
+			return tdlist
 
 		for p in pp:
 			partner = self.GetTPerson(p[1], dateformat)
@@ -418,13 +886,14 @@ class Database:
 						cp = 'private'
 						break
 					else:
-						csubj = c.GetTPerson(dateformat)
-						cp += self.GetTDescendants(level+1, c, csubj, dateformat)
+						csubj = self.GetTPerson(c.uniq, dateformat)
+						cp += self.GetTDescendants(levels-1, c, csubj, dateformat, cache)
 			if cp == []:
 				cp = None
-			td = T_Descendants(level, subj, partner, cp)
+			td = T_Descendants(1, subj, partner, cp)
 			tdlist.append(td)
 
+		cache[key] = tdlist
 		return tdlist
 
 	# Return a descendant tree dictionary for a person.
@@ -435,12 +904,32 @@ class Database:
 		if subj == None:
 			return None
 
+		if self.desc_cache == None:
+			cache = {}
+		else:
+			cache = self.desc_cache
+
 		info = {}
 		info['cardbase'] = Config.GetCardbase()
 		info['subj'] = subj
-		info['partners'] = self.GetTDescendants(1, self.persons[uniq], subj, fmt)
+		tdlist = self.GetTDescendants(Config.Get('depth'), self.persons[uniq], subj, fmt, cache)
+		info['partners'] = [T_DescendantsView(td, 0) for td in tdlist]
 		return info
 
+	# Keep the descendant subtrees built by GetDescendants() until StopDescendantCache() is called,
+	# so that a batch of overlapping trees builds the subtree of each person only once.
+	# The database must not be changed while the cache is active.
+	#
+	def StartDescendantCache(self):
+		self.desc_cache = {}
+		return
+
+	# Discard the cached descendant subtrees
+	#
+	def StopDescendantCache(self):
+		self.desc_cache = None
+		return
+
 	# Return a partial ancestor tree
 	# OBSOLETE: this method can be removed when the text ancestor command has been refactored.
 	#
@@ -519,20 +1008,51 @@ class Database:
 
 	# Return a T_AncestorNode() object for a given person
 	#
-	def GetTAncestorNode(self, person, level, dateformat):
+	# The nodes parameter contains the node of every person already placed in the tree and the path
+	# parameter contains the persons between the root and this person. When an ancestor is reached
+	# again by a different line (pedigree collapse), the ancestor's parents are not repeated; instead the
+	# new node refers to the earlier one via its collapsed member. This is only done if the earlier node is
+	# at the same or a lower level, otherwise the depth limit might have cut off ancestors that would be
+	# shown here; in that case the ancestor is expanded again. Reaching a person who is already on the
+	# path means that the person is his or her own ancestor, which is an error in the database.
+	# Parents are not added beyond the level given by the depth configuration variable.
+	#
+	def GetTAncestorNode(self, person, level, dateformat, nodes, path):
 		if self.maxlevel < level:
 			self.maxlevel = level
-		node = T_AncestorNode(level, person.GetTPerson(dateformat))
+		node = T_AncestorNode(level, self.GetTPerson(person.uniq, dateformat))
+		nodes[person.uniq] = node
+
+		if level >= Config.Get('depth'):
+			return node
 
 		# Count the number of rows occupied by parent nodes
 		rowspan = 0
 
 		# Fill in the parents who exist in the database
+		path.add(person.uniq)
 		for index, id in enumerate( (person.father_uniq, person.mother_uniq) ):
 			if id != None and self.persons[id] != None:
-				pnode = self.GetTAncestorNode(self.persons[id], level+1, dateformat)
+				parent = self.persons[id]
+				if id in path:
+					print('Error: ancestor loop:', parent.GetVitalLine(), 'is an ancestor of', person.GetVitalLine())
+					collapse = True
+				elif id in nodes and nodes[id].level <= level+1:
+					# Collapse only if there are ancestors to omit
+					collapse = (parent.father_uniq != None or parent.mother_uniq != None or
+								parent.father_name != None or parent.mother_name != None)
+				else:
+					collapse = False
+				if collapse:
+					pnode = T_AncestorNode(level+1, nodes[id].subj)
+					pnode.collapsed = nodes[id]
+					if self.maxlevel < level+1:
+						self.maxlevel = level+1
+				else:
+					pnode = self.GetTAncestorNode(parent, level+1, dateformat, nodes, path)
 				rowspan += pnode.rowspan
 				node.AddParent(index, pnode)
+		path.discard(person.uniq)
 
 		# Fill in parents whose names are given but who don't exist in the database
 		for index, name in enumerate( (person.father_name, person.mother_name) ):
@@ -563,14 +1083,25 @@ class Database:
 
 		anc = {}
 		self.maxlevel = 0
+		root = self.GetTAncestorNode(p, 1, dateformat, {}, set())
 		anc['cardbase'] = Config.GetCardbase()
-		anc['root'] = [ self.GetTAncestorNode(p, 1, dateformat) ]
+		anc['root'] = [ root ]
 		anc['nlevels'] = self.maxlevel
 		return anc
 
 	# Return a T_Person object for a person of given unique id, or None if person not found
 	#
+	# The object is shared by all callers and must not be modified. A caller that needs to change the
+	# object must modify a copy (see T_Person.Copy()). The objects are created on demand for each date
+	# format and discarded when the person is reloaded.
+	#
 	def GetTPerson(self, uniq, dateformat):
+		if dateformat == None:
+			dateformat = Config.Get('dateformat')
+		try:
+			return self.tpersons[uniq][dateformat]
+		except KeyError:
+			pass
 		try:
 			p = self.persons[uniq]
 			if p == None:
@@ -578,7 +1109,16 @@ class Database:
 		except:
 			# Out of range
 			return None
-		return p.GetTPerson(dateformat)
+		tp = p.GetTPerson(dateformat)
+		self.tpersons.setdefault(uniq, {})[dateformat] = tp
+		return tp
+
+	# Create the T_Person objects for all persons in the given date format in advance
+	#
+	def FillTPersonCache(self, dateformat):
+		for p in filter(lambda x: x != None, self.persons):
+			self.GetTPerson(p.uniq, dateformat)
+		return
 
 	# Return a dictionary containing the information for an individual's HTML page.
 	# See templates/person-card-html.tmpl for structure and contents
@@ -586,7 +1126,7 @@ class Database:
 	def GetPersonCardInfo(self, person, dateformat = 'yearonly'):
 		info = {}
 		info['cardbase'] = Config.GetCardbase()
-		info['subj'] = person.GetTPerson(dateformat)
+		info['subj'] = self.GetTPerson(person.uniq, dateformat)
 		info['father'] = self.GetTPerson(person.father_uniq, dateformat)
 		if info['father'] == None and person.father_name != None:
 			info['father'] = T_Person(person.father_name, None)
@@ -602,20 +1142,21 @@ class Database:
 
 		info['siblings'] = []
 		info['others'] = []
-		for sib in self.GetSiblings(person.uniq):	# Non-empty: always contains the person themself
-			tsib = sib.GetTPerson(dateformat)
+		for (s_uniq, (s_father, s_mother)) in self.relations.GetSiblings(person):
+			sib = self.persons[s_uniq]
+			tsib = self.GetTPerson(sib.uniq, dateformat).Copy()
 			info['siblings'].append(tsib)
 			other = None
 			if tsib.uniq == person.uniq:
 				# For the person thmself, remove the link and replace DoB-DoD with '(self)'
 				tsib.file = None
 				tsib.vital = tsib.name + ' (self)'
-			elif sib.father_uniq != person.father_uniq:
+			elif s_father != person.father_uniq:
 				# Half-sibling; different father
-				other = sib.father_uniq
-			elif sib.mother_uniq != person.mother_uniq:
+				other = s_father
+			elif s_mother != person.mother_uniq:
 				# Half-sibling; different mother
-				other = sib.mother_uniq
+				other = s_mother
 			else:
 				# Full sibling: nothing to do
 				pass
@@ -627,8 +1168,8 @@ class Database:
 						break
 					o_index += 1
 				if tsib.other == None:
-					tother = self.GetTPerson(other, dateformat)
-					if sib.father_uniq == person.father_uniq:
+					tother = self.GetTPerson(other, dateformat).Copy()
+					if s_father == person.father_uniq:
 						tother.other = 'Mother'
 					else:
 						tother.other = 'Father'
@@ -652,7 +1193,7 @@ class Database:
 			info['partners'] = 'private'
 		else:
 			for ch in children:
-				tch = ch.GetTPerson(dateformat)
+				tch = self.GetTPerson(ch.uniq, dateformat).Copy()
 				info['children'].append(tch)
 				if person.uniq == ch.father_uniq:
 					tch.other = ch.mother_uniq
@@ -682,6 +1223,30 @@ class Database:
 		info['files'] = factory.files
 		return info
 
+	# Return the persons whose cards can affect a person's HTML card (see GetPersonCardInfo()), without
+	# creating the card's information. The result is a list of (uniq, private) tuples in order of uniq,
+	# where private is the calculated privacy for a child when the privacy of children is shown, otherwise None.
+	#
+	def GetCardPersons(self, person):
+		uniqs = set([person.uniq, person.father_uniq, person.mother_uniq])
+		for (s_uniq, (s_father, s_mother)) in self.relations.GetSiblings(person):
+			uniqs.update((s_uniq, s_father, s_mother))
+		children = self.relations.GetChildren(person.uniq)
+		for c_uniq in children:
+			c = self.persons[c_uniq]
+			uniqs.update((c_uniq, c.father_uniq, c.mother_uniq))
+		for (date, sp_uniq, sp_name) in self.relations.GetPartners(person.uniq):
+			uniqs.add(sp_uniq)
+		uniqs.discard(None)
+		public = (Config.Get('generate') == 'public')
+		persons = []
+		for uniq in sorted(uniqs):
+			private = None
+			if public and uniq in children:
+				private = self.IsPrivate(uniq)
+			persons.append((uniq, private))
+		return persons
+
 	# Return a dictionary containing the information for an HTML surname index page.
 	# See templates/surname-index-html.tmpl for structure and contents
 	#
@@ -717,44 +1282,53 @@ class Database:
 			
 		return info
 
-	# Verify that all reference links between people exist.
-	# Also check that the names are correct.
+	# Verify the references to parents and spouses of all the persons in the database, or of the persons
+	# in a given list. The problems are printed in order as they are found.
 	#
-	def VerifyRefs(self):
-		n_errs = 0
-		for p in filter(lambda x: x != None, self.persons):
+	# The partnerships are checked against the spouse-pair index (see Relations), so each check is a
+	# single lookup instead of a search through the spouse's events.
+	#
+	# Returns a list of (uniq, rel, ref_uniq, ref_name, problem) tuples, one for each problem found:
+	# uniq is the person whose card contains the reference, rel is 'father', 'mother' or 'spouse' and
+	# ref_uniq and ref_name identify the referenced person as written on the card.
+	#
+	def VerifyRefs(self, plist = None):
+		if plist == None:
+			plist = filter(lambda x: x != None, self.persons)
+		problems = []
+		for p in plist:
 			if p.father_uniq != None:
-				n_errs += self.VerifyPerson(p.father_uniq, p.father_name, p, 'father')
+				self.VerifyPerson(p.father_uniq, p.father_name, p, 'father', problems)
 			if p.mother_uniq != None:
-				n_errs += self.VerifyPerson(p.mother_uniq, p.mother_name, p, 'mother')
+				self.VerifyPerson(p.mother_uniq, p.mother_name, p, 'mother', problems)
 			for ev in p.partnerships:
 				(sp_name, sp_uniq) = Person.ParseCombinedNameString(ev.rest)
-				e = self.VerifyPerson(sp_uniq, sp_name, p, 'spouse')
-				if e == 0:
+				if sp_uniq == None:
+					pass
+				elif self.VerifyPerson(sp_uniq, sp_name, p, 'spouse', problems) == 0:
 					sp = self.persons[sp_uniq]
 					found = 0
-					for sp_ev in sp.partnerships:
-						(xx_name, xx_uniq) = Person.ParseCombinedNameString(sp_ev.rest)
-						if xx_uniq == p.uniq and xx_name == p.name:
-							if sp_ev.date == ev.date:
+					for (xx_name, xx_date) in self.relations.GetSpouseEntries(sp_uniq, p.uniq):
+						if xx_name == p.name:
+							if xx_date == ev.date:
 								found = 1
 								break
 							else:
 								found = 2
 					if found == 0:
 						print(sp.GetVitalLine(), 'has no spouse', p.GetVitalLine())
-						n_errs += 1
+						problems.append((p.uniq, 'spouse', sp_uniq, sp_name, 'no matching partnership'))
 					elif found == 2:
 						print(p.GetVitalLine(), 'has spouse', sp.GetVitalLine(),
 									'with different date')
-						n_errs += 1
-				else:
-					n_errs += e
-		return n_errs
+						problems.append((p.uniq, 'spouse', sp_uniq, sp_name, 'different date'))
+		return problems
 
-	# Verify an individual name/id against the database
+	# Verify an individual name/id against the database.
+	# A problem is printed and appended to the list of problems (see VerifyRefs()).
+	# Returns the number of problems found (0 or 1).
 	#
-	def VerifyPerson(self, uniq, name, p, rel):
+	def VerifyPerson(self, uniq, name, p, rel, problems):
 		msg = None
 		if uniq < len(self.persons):
 			pp = self.persons[uniq]
@@ -767,18 +1341,78 @@ class Database:
 
 		if msg != None:
 			print(p.GetVitalLine(), rel, name, '['+str(uniq)+'] :', msg)
+			problems.append((p.uniq, rel, uniq, name, msg))
 			return 1
 		return 0
 
+	# Check the relationship index (see Relations) against a scan of all the persons in the database,
+	# reading the parents and partnerships from the persons themselves as was done before the index
+	# existed. The children, siblings, partners and partner references of every person and whether the
+	# person is a head are compared. Each difference is printed.
+	# Returns the number of differences found.
+	#
+	def CheckRelations(self):
+		persons = [p for p in self.persons if p != None]
+		children = {}
+		by_father = {}
+		by_mother = {}
+		refs = {}
+		spouses = {}
+		for p in persons:
+			entry = (p.GetDoBKey(), p.uniq)
+			for parent in set([p.father_uniq, p.mother_uniq]):
+				if parent != None:
+					children.setdefault(parent, []).append(entry)
+			if p.father_uniq != None:
+				by_father.setdefault(p.father_uniq, []).append(entry)
+			if p.mother_uniq != None:
+				by_mother.setdefault(p.mother_uniq, []).append(entry)
+			for ev in p.partnerships:
+				(sp_name, sp_uniq) = Person.ParseCombinedNameString(ev.rest)
+				if sp_uniq != None:
+					refs.setdefault(sp_uniq, set()).add(p.uniq)
+					spouses.setdefault((p.uniq, sp_uniq), []).append((sp_name, ev.date))
+
+		n_diffs = 0
+		for p in persons:
+			checks = []
+
+			scanned = [uniq for (dob, uniq) in sorted(children.get(p.uniq, []))]
+			checks.append(('children', scanned, self.relations.GetChildren(p.uniq)))
+
+			sibs = set(by_father.get(p.father_uniq, [])) | set(by_mother.get(p.mother_uniq, []))
+			scanned = [uniq for (dob, uniq) in sorted(sibs)]
+			checks.append(('siblings', scanned, [uniq for (uniq, parents) in self.relations.GetSiblings(p)]))
+
+			checks.append(('partners', p.GetPartners(), self.GetPartners(p.uniq)))
+
+			checks.append(('partner references', refs.get(p.uniq, set()),
+							set(self.relations.GetPartnerRefs(p.uniq))))
+
+			for (date, sp_uniq, sp_name) in self.relations.GetPartners(p.uniq):
+				if sp_uniq != None:
+					checks.append(('partnerships with ['+str(sp_uniq)+']', spouses.get((p.uniq, sp_uniq), []),
+									self.relations.GetSpouseEntries(p.uniq, sp_uniq)))
+
+			head = not p.HasParents()
+			if head and p.GetPartners() != None:
+				for (date, sp_uniq) in p.GetPartners():
+					if sp_uniq != None and self.persons[sp_uniq].HasParents():
+						head = False
+			checks.append(('head', head, self.IsHead(p)))
+
+			for (what, scanned, indexed) in checks:
+				if scanned != indexed:
+					print(p.GetVitalLine(), ':', what, 'differ; index', indexed, 'scan', scanned)
+					n_diffs += 1
+		return n_diffs
+
 	# Return True if a person has no recorded parents AND none of the spouses has recorded parents
 	#
 	def IsHead(self, p):
 		if p.HasParents():
 			return False
-		pp = p.GetPartners()		# Returns None or a list of (date, sp_uniq) tuples
-		if pp == None:
-			return True
-		for (x, sp_uniq) in pp:
+		for (date, sp_uniq, sp_name) in self.relations.GetPartners(p.uniq):
 			if sp_uniq != None and self.persons[sp_uniq].HasParents():
 				return False
 		return True
@@ -815,6 +1449,9 @@ class Database:
 			return 1
 
 		g = GedcomImporter(path, self)
+		self.tpersons = {}
+		self.relations.Build(self.persons)
+		self.names.Build(self.persons)
 
 		return 0
 
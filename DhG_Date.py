@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of DhG.
+#
+# DhG is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DhG is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DhG.  If not, see <http://www.gnu.org/licenses/>.
+
+# A class to hold a date as used in the card files
+#
+# A date has the form YYYY, YYYY-MM, YYYY-MM-DD or YYYY-Qn (quarter), optionally followed by a qualifier:
+# '~' (about), '<' (before) or '>' (after). Anything else is an unknown date.
+#
+# Each distinct date string is analysed only once: Date.Get() returns the same Date object for equal
+# strings. The formatted forms of the date are remembered as they are requested.
+#
+# The sort key is an integer that orders dates chronologically. Dates with only a year come before
+# dates in that year with a month, which come before dates with a day. For the same date, 'before'
+# comes first and 'after' last; a quarter counts as about its middle month. Unknown dates come last.
+#
+class Date():
+	__slots__ = ('raw', 'year', 'month', 'day', 'quarter', 'qualifier', 'key', 'formats')
+
+	gedmonths = ['XXX', 'JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+	qmonths = [ '?', '02', '05', '08', '11' ]
+	qualifiers = { '<': 0, '': 1, '~': 2, '>': 3 }
+	unknown_key = 1 << 62
+	dates = {}				# Date objects indexed by the date string
+
+	def __init__(self, raw):
+		self.raw = raw				# The date string as given
+		self.year = None			# Year, or None if the date is unknown
+		self.month = None			# Month (1-12); the middle month for a quarter. None if not given.
+		self.day = None				# Day of the month, or None if not given
+		self.quarter = None			# Quarter (1-4), or None if not given
+		self.qualifier = ''			# '~', '<', '>' or ''
+		self.key = Date.unknown_key	# Sort key
+		self.formats = {}			# Formatted versions indexed by format
+		self.Parse()
+		return
+
+	# Return the Date object for a date string
+	#
+	@staticmethod
+	def Get(raw):
+		try:
+			return Date.dates[raw]
+		except KeyError:
+			pass
+		d = Date(raw)
+		Date.dates[raw] = d
+		return d
+
+	# Return the sort key for a date string. None is an unknown date.
+	#
+	@staticmethod
+	def SortKey(raw):
+		if raw == None:
+			return Date.unknown_key
+		return Date.Get(raw).key
+
+	# Analyse the date string
+	#
+	def Parse(self):
+		odate = self.raw
+		if odate == '':
+			return
+		if odate[-1] in '~<>':
+			self.qualifier = odate[-1]
+			odate = odate[0:-1]
+		parts = odate.split('-')
+		try:
+			self.year = int(parts[0])
+		except ValueError:
+			return
+		q = Date.qualifiers[self.qualifier]
+		if len(parts) > 1:
+			mm = parts[1]
+			if mm[0:1].upper() == 'Q':
+				try:
+					self.quarter = int(mm[1:])
+					self.month = int(Date.qmonths[self.quarter])
+				except (ValueError, IndexError):
+					self.quarter = None
+				if self.qualifier == '':
+					q = Date.qualifiers['~']
+			else:
+				try:
+					self.month = int(mm)
+				except ValueError:
+					pass
+		if len(parts) > 2:
+			try:
+				self.day = int(parts[2])
+			except ValueError:
+				pass
+		mm = min(self.month or 0, 12)
+		dd = min(self.day or 0, 31)
+		self.key = ((self.year * 13 + mm) * 32 + dd) * 4 + q
+		return
+
+	# Return the date in the specified format
+	#
+	# Date formats are:
+	#	raw      -- exactly as entered
+	#	cooked	 -- approximations rendered as abt, bef and aft, quarters changed to abt <middle month>
+	#	yearonly -- only the year, approxmations ignored if they come after month or day.
+	#	gedcom   -- as required by GEDCOM
+	# Any format not lists above is treated as cooked.
+	#
+	def Format(self, fmt):
+		try:
+			return self.formats[fmt]
+		except KeyError:
+			pass
+		s = self.DoFormat(fmt)
+		self.formats[fmt] = s
+		return s
+
+	# Format the date. Called by Format() for each format the first time it is needed
+	#
+	def DoFormat(self, fmt):
+		if fmt == 'raw':
+			# Raw format - return the date unmodified.
+			return self.raw
+
+		# Convert and remove the modifier suffix
+		odate = self.raw
+		mod = odate[-1]
+		if mod == '~':
+			mod = 'abt.'
+		elif mod == '<':
+			mod = 'bef.'
+		elif mod == '>':
+			mod = 'aft.'
+		else:
+			mod = ''
+		if mod != '':
+			odate = odate[0:-1]
+			if fmt == 'gedcom':
+				mod = mod[0:3].upper() + ' '
+
+		# Split into YYYY, MM and DD maybe not all present.
+		parts = odate.split('-')
+		if len(parts) <= 1:
+			# Only the year is available. Modifier applies to year
+			return mod+odate
+
+		yy = parts[0]
+		if fmt == 'yearonly':
+			# More than the year is available, but only the year is required. Modifier not applied.
+			return yy
+
+		mm = parts[1]
+		if mm[0].upper() == 'Q':
+			# Convert quarter to middle month of quarter and use 'abt.'
+			try:
+				mm = Date.qmonths[int(mm[1])]
+			except:
+				pass
+			if fmt == 'gedcom':
+				try:
+					gedmonth = Date.gedmonths[int(mm)]
+				except:
+					gedmonth = Date.gedmonths[0]
+				return 'ABT ' + gedmonth + ' ' + yy
+			return 'abt.' + yy + '-' + mm
+
+		if fmt == 'gedcom':
+			try:
+				gedmonth = Date.gedmonths[int(mm)]
+			except:
+				gedmonth = Date.gedmonths[0]
+			if len(parts) <= 2:
+				dd = ''
+			else:
+				dd = parts[2] + ' '
+			return mod + dd + gedmonth + ' ' + yy
+
+		# Nothing else specified. Return "raw" date but with standardised modifier as prefix
+		return mod+odate
@@ -18,19 +18,42 @@
 # along with DhG.  If not, see <http://www.gnu.org/licenses/>.
 
 from DhG_Config import Config
+from DhG_Date import Date
 from DhG_Template import T_Person, T_Event, T_EvInfo, T_Source, T_Transcript, T_File
 import os
+import sys
 import traceback
 
 # Event class - represents an event on a person's timeline
 #
 class Event:
+	__slots__ = ('lines', 'owner', 'date', 'etype', 'rest', 'model', 'lineno')
+
+	# Event types that determine a person's vital information and family relationships
+	vital_types = ('birth', 'death', 'marriage', 'partnership')
+
 	def __init__(self):
 		self.lines = None
 		self.owner = None
 		self.date = None
 		self.etype = None
 		self.rest = None
+		self.model = None		# Compiled form of the lines (see GetModel())
+		self.lineno = None		# Line number of the first line in the card file, if known
+
+	# Return a compact record of the event containing only built-in types
+	#
+	def GetRecord(self):
+		return (self.lines, self.date, self.etype, self.rest)
+
+	# Create an event from a record returned by GetRecord()
+	#
+	@staticmethod
+	def FromRecord(rec, owner):
+		e = Event()
+		(e.lines, e.date, e.etype, e.rest) = rec
+		e.owner = owner
+		return e
 
 	# Add a line of text to the event
 	# The first line is the date and the event type
@@ -40,12 +63,27 @@ class Event:
 			self.lines = [line]
 			return
 		self.lines.append(line)
+		msg = Event.CheckLine(line)
+		if msg != None:
+			print(msg)
+		return
+
+	# Check the form of a line after the first line of an event
+	# Returns a message describing the problem, or None if the line is acceptable
+	#
+	@staticmethod
+	def CheckLine(line):
 		if line == '':
-			return
+			return None
 		if line[0] == '#' or line[0] == '+' or line[0] == '-' or line[0] == '|':
-			return
-		print('Invalid form for event line: "'+line+'"')
-		return
+			return None
+		return 'Invalid form for event line: "'+line+'"'
+
+	# Return True if the first line of the event is one of the vital types
+	#
+	def IsVital(self):
+		parts = self.lines[0].split(maxsplit=2)
+		return len(parts) > 1 and parts[1].lower() in Event.vital_types
 
 	# Decode the first line of the event
 	#
@@ -53,8 +91,8 @@ class Event:
 		self.owner = owner
 		parts = self.lines[0].split(maxsplit=2)
 		try:
-			self.date = parts[0]
-			self.etype = parts[1]
+			self.date = sys.intern(parts[0])
+			self.etype = sys.intern(parts[1])
 		except:
 			print('Insufficient fields in event date line', self.lines[0], 'in', owner.filename)
 
@@ -67,7 +105,22 @@ class Event:
 	def GetDate(self, fmt):
 		return Config.FormatDate(self.date, None, fmt)
 
+	# Return an integer for sorting events by date (see Date.SortKey())
+	#
+	def GetDateKey(self):
+		return Date.SortKey(self.date)
+
+	# Return the compiled form of the event's supplementary lines (see EventCompiler)
+	# The lines are compiled on first use and the result is kept with the event.
+	#
+	def GetModel(self):
+		if self.model == None:
+			self.model = EventCompiler(self.lines).Compile()
+		return self.model
+
 	# Return a T_Event structure for templates
+	# The T_Event is built from the compiled form of the event. Warnings found while compiling the lines
+	# are printed each time, in the same order as the items that they belong to.
 	#
 	def GetTEvent(self, factory):
 		# Create the basic T_Event structure
@@ -89,9 +142,72 @@ class Event:
 
 		e = T_Event(self.GetDate('cooked'), etype, tp)
 
-		# Now parse the rest of the lines
+		for item in self.GetModel():
+			kind = item[0]
+			if kind == 'warning':
+				print(item[2])
+			elif kind == 'info':
+				(kind, index, caption, info, url, moreinfo) = item
+				ei = T_EvInfo(caption, info)
+				ei.url = url
+				if moreinfo != None:
+					for (c, t) in moreinfo:
+						ei.AddInfo(T_EvInfo(c, t))
+				e.information.append(ei)
+			elif kind == 'source':
+				e.sources.append(self.GetTSource(factory, item))
+		return e
+
+	# Return a T_Source object for a compiled source item
+	#
+	def GetTSource(self, factory, item):
+		(kind, index, descr, entries) = item
+		src = T_Source(descr)
+		for entry in entries:
+			kind = entry[0]
+			if kind == 'warning':
+				print(entry[2])
+			elif kind == 'link':
+				src.AddRef('Link', entry[2])
+			elif kind == 'file':
+				(ref, tref) = factory.AddFile(entry[2], entry[3])
+				src.AddRef(ref, '#'+ref)
+				if tref != None:
+					src.AddRef(tref, '#'+tref)
+			elif kind == 'transcript':
+				(ref, tx) = factory.AddTranscript(entry[2])
+				src.AddRef(ref, '#'+ref)
+			elif kind == 'info':
+				src.AddInfo(T_EvInfo(entry[2], entry[3]))
+		return src
+
+# A class to compile the supplementary lines of an event
+#
+# The lines after the first line of an event hold information items (+Place etc.) and sources (+Source)
+# with their sub-items and continuation lines. Compile() turns them into a tuple of items made of
+# built-in types only, so that the lines are analysed once and the result can be shared:
+#	('info', index, caption, info, url, moreinfo)	- moreinfo is None or a tuple of (caption, info) pairs
+#	('source', index, descr, entries)				- entries is a tuple of:
+#		('link', index, url)
+#		('file', index, ftype, fname)
+#		('transcript', index, text)
+#		('info', index, caption, info)
+#		('warning', index, message)
+#	('warning', index, message)
+# The index is the index in the event's lines of the line that starts the item or of the offending line.
+# Continuation lines are already joined to the text of the item they continue.
+#
+class EventCompiler():
+	def __init__(self, lines):
+		self.lines = lines
+		self.nlines = len(lines)
+		self.items = []
+		return
+
+	# Compile the lines and return the items
+	#
+	def Compile(self):
 		i = 1
-		self.nlines = len(self.lines)
 		while i < self.nlines:
 			line = self.lines[i].lstrip().rstrip()
 			i += 1
@@ -100,24 +216,31 @@ class Event:
 			if line[0] == '+':
 				parts = line.split(maxsplit=1)
 				if parts[0].lower() == '+source':
-					(i, src) = self.GetTSource(factory, parts, i)
-					e.sources.append(src)
+					i = self.CompileSource(parts, i)
 				else:
 					# Event information
-					(i, ei) = self.GetTEvInfo(parts, i)
-					e.information.append(ei)
+					i = self.CompileEvInfo(parts, i)
 			else:
 				# Line not starting with + found at outer level :-(
-				print('GetTEvent() warning: "'+line+'" found at top level. Ignored')
-		return e
+				self.Warning(self.items, i-1, 'GetTEvent() warning: "'+line+'" found at top level. Ignored')
+		return tuple(self.items)
 
-	# Return a T_EvInfo object and the index of the line after the info
+	# Add a warning to a list of items
 	#
-	def GetTEvInfo(self, parts, i):
+	def Warning(self, items, index, message):
+		items.append(('warning', index, message))
+		return
+
+	# Compile an information item. Returns the index of the line after the item
+	#
+	def CompileEvInfo(self, parts, i):
+		start = i-1
 		if len(parts) < 2:
-			evinfo = T_EvInfo(parts[0][1:], '')
+			evinfo = [parts[0][1:], '']
 		else:
-			evinfo = T_EvInfo(parts[0][1:], parts[1])
+			evinfo = [parts[0][1:], parts[1]]
+		url = None
+		moreinfo = []
 		curinfo = evinfo
 		while i < self.nlines:
 			line = self.lines[i]
@@ -126,23 +249,24 @@ class Event:
 				continue		# Ignore blanks and comments
 			if line[0] == '+':
 				# Next item
-				return (i-1, evinfo)
+				i -= 1
+				break
 			if line[0] == '|':
 				# Continuation character
 				if curinfo == None:
-					print('GetTEvInfo() warning: "'+line+'" nothing to continue. Ignored')
+					self.Warning(self.items, i-1, 'GetTEvInfo() warning: "'+line+'" nothing to continue. Ignored')
 				else:
 					txt = line[1:]
 					if txt != '':
-						curinfo.info += ' ' + txt
+						curinfo[1] += ' ' + txt
 			elif line[0] == '-':
 				# Supplementary information
 				parts = line.split(maxsplit=1)
 				if parts[0].lower() == '-url':
 					if len(parts) < 2:
-						print('GetTEvInfo() warning: "'+line+'" no url provided. Ignored')
+						self.Warning(self.items, i-1, 'GetTEvInfo() warning: "'+line+'" no url provided. Ignored')
 					else:
-						evinfo.url = parts[1]
+						url = parts[1]
 					curinfo = None			# No more continuation lines until next item
 				elif parts[0].lower() == '-Uniq':
 					# ToDo: the event info mentions a person in the database. This is the ID
@@ -151,20 +275,30 @@ class Event:
 					curinfo = None			# No more continuation lines until next item
 				else:
 					if len(parts) < 2:
-						curinfo = T_EvInfo(parts[0][1:], '')
+						curinfo = [parts[0][1:], '']
 					else:
-						curinfo = T_EvInfo(parts[0][1:], parts[1])
-					evinfo.AddInfo(curinfo)
+						curinfo = [parts[0][1:], parts[1]]
+					moreinfo.append(curinfo)
 			else:
-				print('GetTEvInfo() warning: "'+line+'" not recognised. Ignored')
+				self.Warning(self.items, i-1, 'GetTEvInfo() warning: "'+line+'" not recognised. Ignored')
 
-		return (i, evinfo)
+		if len(moreinfo) == 0:
+			moreinfo = None
+		else:
+			moreinfo = tuple((sys.intern(c), t) for (c, t) in moreinfo)
+		self.items.append(('info', start, sys.intern(evinfo[0]), evinfo[1], url, moreinfo))
+		return i
 
-	# Return a T_Source object and the index of the line after the source block
+	# Compile a source. Returns the index of the line after the source block
 	#
-	def GetTSource(self, factory, parts, i):
-		src = T_Source(parts[1])
-		curobj = None				# The object to add continuation lines to.
+	def CompileSource(self, parts, i):
+		start = i-1
+		if len(parts) < 2:
+			descr = ''
+		else:
+			descr = parts[1]
+		entries = []
+		curobj = None				# The entry to add continuation lines to.
 		while i < self.nlines:
 			line = self.lines[i]
 			i += 1
@@ -172,16 +306,19 @@ class Event:
 				continue		# Ignore blanks and comments
 			if line[0] == '+':
 				# Next item
-				return (i-1, src)
+				i -= 1
+				break
 			if line[0] == '|':
 				# Continuation character
 				if curobj == None:
-					print('GetTSource warning: "'+line+'" nothing to continue. Ignored')
+					self.Warning(entries, i-1, 'GetTSource warning: "'+line+'" nothing to continue. Ignored')
 				else:
 					txt = line[1:]
 					if len(txt) > 1 and txt[0] == ' ':
 						txt = txt[1:]
-					curobj.AppendLine(txt)
+					if curobj[-1] != '':
+						curobj[-1] += '\n'
+					curobj[-1] += txt
 			elif line[0:5].lower() == '-todo':
 				pass	# Ignore ToDos
 			elif line[0] == '-':
@@ -190,29 +327,26 @@ class Event:
 				parts = line.split(maxsplit=1)
 				if parts[0].lower() == '-url':
 					if len(parts) != 2:
-						print('GetTSource() warning: "'+line+'" not recognised. Ignored')
+						self.Warning(entries, i-1, 'GetTSource() warning: "'+line+'" not recognised. Ignored')
 						continue
-					src.AddRef('Link', parts[1])
+					entries.append(['link', i-1, parts[1]])
 				elif parts[0].lower() == '-file':
 					if len(parts) != 2:
-						print('GetTSource() warning: "'+line+'" not recognised. Ignored')
+						self.Warning(entries, i-1, 'GetTSource() warning: "'+line+'" not recognised. Ignored')
 						continue
 					fparts = parts[1].split(maxsplit=1)
 					if len(fparts) != 2:
-						print('GetTSource() warning: "'+line+'" not recognised. Ignored')
+						self.Warning(entries, i-1, 'GetTSource() warning: "'+line+'" not recognised. Ignored')
 						continue
-					(ref, tref) = factory.AddFile(fparts[0], fparts[1])
-					src.AddRef(ref, '#'+ref)
-					if tref != None:
-						src.AddRef(tref, '#'+tref)
+					entries.append(['file', i-1, fparts[0], fparts[1]])
 				elif parts[0].lower() == '-transcript':
 					if len(parts) >= 2:
 						txt = parts[1]
 					else:
 						txt = ''
-					(ref, curobj) = factory.AddTranscript(txt)
-					src.AddRef(ref, '#'+ref)
-				elif src.descr.lower() == 'personal knowledge' and (
+					curobj = ['transcript', i-1, txt]
+					entries.append(curobj)
+				elif descr.lower() == 'personal knowledge' and (
 							parts[0].lower() == '-of' or parts[0].lower() == '-from'):
 					# Ignore "Personal knowledge" of/from - might be private
 					pass
@@ -221,11 +355,12 @@ class Event:
 						txt = parts[1]
 					else:
 						txt = ''
-					curobj = T_EvInfo(parts[0][1:], txt)
-					src.AddInfo(curobj)
+					curobj = ['info', i-1, sys.intern(parts[0][1:]), txt]
+					entries.append(curobj)
 			else:
-				print('GetTSource() warning: "'+line+'" not recognised. Ignored')
-		return (i, src)
+				self.Warning(entries, i-1, 'GetTSource() warning: "'+line+'" not recognised. Ignored')
+		self.items.append(('source', start, descr, tuple(tuple(e) for e in entries)))
+		return i
 
 # A class to create a list of T_Event objects for a template,
 # along with the associated list of T_Transcript and T_File objects
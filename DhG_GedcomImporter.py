@@ -199,11 +199,12 @@ class GedcomImporter():
 
 	# Insert an event into the event list in sorted order
 	# Birth is assumed to be event[0], death is appended afterwards, so is always last.
-	# '?' is greater than all digits, so events with unknown dates come after those with known dates
+	# Events with unknown dates come after those with known dates (see Date.SortKey())
 	#
 	def InsertEvent(self, list, event):
+		key = event.GetDateKey()
 		for i in range(1, len(list)):
-			if list[i].date > event.date:
+			if list[i].GetDateKey() > key:
 				list.insert(i, event)
 				return
 		list.append(event)
@@ -0,0 +1,243 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of DhG.
+#
+# DhG is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DhG is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DhG.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import io
+import time
+import contextlib
+import traceback
+import multiprocessing
+from time import strftime, gmtime
+from DhG_Config import Config
+from DhG_Template import DoTemplate
+from DhG_Manifest import Manifest
+
+# The generator that is creating the cards.
+# The worker processes inherit it from the main process when they are started.
+#
+generator = None
+
+# Create the card for a single person in a worker process
+#
+def GenerateCard(uniq):
+	return generator.GenerateCard(uniq)
+
+# A class to create the HTML cards for many persons
+#
+# The cards are independent of each other, so they can be created by a pool of worker processes. The
+# workers are started by forking the main process, so they have a copy of the database, including
+# the relationship indexes and the calculated privacy. The privacy must be calculated for the whole
+# database before the workers are started, otherwise each worker would calculate the privacy separately
+# and the result could depend on which worker creates which card.
+#
+# Any messages printed while creating a card are collected and printed by the main process, together with
+# the name of the person, in the same order as the cards. All the cards have the same timestamp. The files
+# are therefore the same whichever number of workers is used.
+#
+# If the incremental configuration variable is 'y', a page is only created if its dependencies have changed
+# since it was last created (see Manifest). WritePage() returns the dependencies of the page and the caller
+# records them in the manifest in the main process. Call Finish() when all the pages have been created.
+#
+# If the skip_unchanged configuration variable is 'y', a page that is identical to the existing file apart
+# from the timestamp is not written (see DoTemplate).
+#
+class HtmlGenerator():
+	def __init__(self, db):
+		self.db = db
+		self.timestamp = strftime('%Y-%m-%d %H:%M UTC', gmtime())
+		self.n_written = 0
+		self.n_unchanged = 0			# Not created because the manifest shows that they are up to date
+		self.n_identical = 0			# Created but not written because the content is the same
+		self.n_failed = 0
+		self.manifest = None
+		if Config.Get('incremental') == 'y':
+			self.manifest = Manifest(db)
+			self.manifest.Load()
+		return
+
+	# Create a page from a template and count the result.
+	# When all pages have been created, call Finish() to save the manifest.
+	#
+	def CreatePage(self, tmpl_name, info, file):
+		(status, deps) = self.WritePage(tmpl_name, info, file)
+		if status == 'written' or status == 'identical':
+			self.PageWritten(file, deps)
+		self.Count(status)
+		return
+
+	# Create the descendant tree page for a person
+	#
+	def CreateDescendantTree(self, person):
+		file = Config.MakeHtmlDescTreeName(person.name, person.uniq)
+		desc = self.db.GetDescendants(person.uniq, 'yearonly')
+		self.CreatePage('descendant-tree-html.tmpl', desc, file)
+		return
+
+	# Create the ancestor tree page for a person
+	#
+	def CreateAncestorTree(self, person):
+		file = Config.MakeHtmlAncTreeName(person.name, person.uniq)
+		anc = self.db.GetAncestors(person.uniq, 'yearonly')
+		self.CreatePage('ancestor-tree-html.tmpl', anc, file)
+		return
+
+	# Create a page from a template, unless the page is up to date.
+	# Returns (status, deps). status is 'written', 'unchanged' (the page is up to date according to the
+	# manifest) or 'identical' (the page was created but is the same as the existing file). deps contains the
+	# dependencies of the page if the generation is incremental, otherwise None.
+	#
+	def WritePage(self, tmpl_name, info, file, quick = None):
+		info['timestamp'] = self.timestamp
+		deps = None
+		if self.manifest != None:
+			deps = self.manifest.GetDependencies(tmpl_name, info)
+			if quick != None:
+				deps['quick'] = quick
+			if self.manifest.IsUpToDate(file, deps):
+				return ('unchanged', None)
+		t = DoTemplate(tmpl_name, info, file, trim = True)
+		if t.written:
+			return ('written', deps)
+		return ('identical', deps)
+
+	# Count the result of creating a page
+	#
+	def Count(self, status):
+		if status == 'written':
+			self.n_written += 1
+		elif status == 'unchanged':
+			self.n_unchanged += 1
+		elif status == 'identical':
+			self.n_identical += 1
+		else:
+			self.n_failed += 1
+		return
+
+	# Print a summary of the numbers of pages created.
+	# The numbers of unchanged and identical pages are only shown if they are relevant.
+	#
+	def PrintSummary(self, what, extra = ''):
+		counts = [str(self.n_written) + ' written']
+		if self.manifest != None:
+			counts.append(str(self.n_unchanged) + ' unchanged')
+		if Config.Get('skip_unchanged') == 'y':
+			counts.append(str(self.n_identical) + ' identical')
+		counts.append(str(self.n_failed) + ' failed')
+		if extra == '':
+			print(what + ':', ', '.join(counts))
+		else:
+			print(what + ':', ', '.join(counts), extra)
+		return
+
+	# Record the dependencies of a page that has been created.
+	# Must be called in the main process, otherwise the record is lost.
+	#
+	def PageWritten(self, file, deps):
+		if self.manifest != None and deps != None:
+			self.manifest.Update(file, deps)
+		return
+
+	# Save the manifest
+	#
+	def Finish(self):
+		if self.manifest != None:
+			self.manifest.Save()
+		return
+
+	# Create the card for a single person.
+	# Returns a (uniq, status, msgs, file, deps) tuple. status is as for WritePage() or 'failed'.
+	# msgs contains everything that was printed.
+	#
+	def GenerateCard(self, uniq):
+		person = self.db.persons[uniq]
+		status = 'failed'
+		file = None
+		deps = None
+		out = io.StringIO()
+		with contextlib.redirect_stdout(out):
+			try:
+				file = Config.MakeHtmlPersonCardName(person.name, person.uniq)
+				quick = None
+				if self.manifest != None:
+					quick = self.manifest.GetQuickKey('person-card-html.tmpl', self.db.GetCardPersons(person))
+				if quick != None and self.manifest.IsQuickUpToDate(file, quick):
+					status = 'unchanged'
+				else:
+					info = self.db.GetPersonCardInfo(person, 'yearonly')
+					(status, deps) = self.WritePage('person-card-html.tmpl', info, file, quick)
+			except Exception:
+				print()
+				print(traceback.format_exc())
+		return (uniq, status, out.getvalue(), file, deps)
+
+	# Create the cards for a list of persons, given by unique ID, and print a summary.
+	# The html_jobs configuration variable gives the number of worker processes.
+	# If a card file watcher is given, it is paused while the worker processes are started.
+	#
+	def GenerateCards(self, uniqs, watcher = None):
+		global generator
+		t0 = time.time()
+		jobs = Config.Get('html_jobs')
+		if jobs == 0:
+			jobs = os.cpu_count()
+		ctx = None
+		if jobs != None and jobs > 1 and len(uniqs) > 1:
+			try:
+				ctx = multiprocessing.get_context('fork')
+			except ValueError:
+				# Forking is not available on this platform. Create the cards serially.
+				ctx = None
+		if ctx == None:
+			self.Report(map(self.GenerateCard, uniqs))
+		else:
+			chunksize = max(1, len(uniqs) // (jobs * 8))
+			generator = self
+			if watcher != None:
+				watcher.Pause()
+			try:
+				with ctx.Pool(jobs) as pool:
+					if watcher != None:
+						watcher.Resume()
+						watcher = None
+					self.Report(pool.imap(GenerateCard, uniqs, chunksize))
+			finally:
+				if watcher != None:
+					watcher.Resume()
+				generator = None
+		t = time.time() - t0
+		n = self.n_written + self.n_unchanged + self.n_identical + self.n_failed
+		if t > 0:
+			rate = '%.1f' % (n / t)
+		else:
+			rate = '-'
+		self.PrintSummary('HTML cards', '(%.2f seconds, %s cards per second)' % (t, rate))
+		self.Finish()
+		return
+
+	# Count the results of creating the cards and print the messages
+	#
+	def Report(self, results):
+		for (uniq, status, msgs, file, deps) in results:
+			self.Count(status)
+			if status == 'written' or status == 'identical':
+				self.PageWritten(file, deps)
+			if msgs != '':
+				print('HTML card for', self.db.persons[uniq].GetVitalLine())
+				print(msgs, end='')
+		return
@@ -0,0 +1,245 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of DhG.
+#
+# DhG is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DhG is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DhG.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import hashlib
+import traceback
+from DhG_Config import Config
+from DhG_Snapshot import Snapshot
+from DhG_Template import T_Person, T_File, T_Transcript
+
+# A class to hold the manifest of the generated HTML files
+#
+# For each generated page the manifest records the content hashes of everything the page depends on:
+#	* the templates used to create the page
+#	* the card of every person that appears on the page, as it was loaded into the database
+#	* the transcript files that are included in the page, and their signatures
+# along with the size and modification time of the page itself.
+#
+# The dependencies of a page are found from the template parameters that are created from the current
+# database, so a person that has been added to a page (for example a new child) or removed from a page
+# changes the dependencies just like a change to one of the cards. A page whose dependencies are the same
+# as in the manifest and that has not been changed since it was written doesn't need to be created again.
+#
+# Finding the dependencies of a page means creating its template parameters, which is most of the work
+# of creating the page. A page can therefore also have a quick key, computed from the database without
+# creating the template parameters (see GetQuickKey()). If the quick key and the signatures of the
+# transcript files are unchanged, IsQuickUpToDate() shows that the page is up to date.
+#
+# The manifest also records the configuration variables that affect the generated files. If any of them
+# has changed, the whole manifest is discarded.
+#
+class Manifest():
+	version = 2
+	config_vars = ['tmpl_path', 'generate', 'html_dir', 'card_path', 'server_path', 'text_path',
+					'text-suffix', 'depth']
+
+	def __init__(self, db):
+		h = Config.Get('html_dir')
+		if h == None or h == '':
+			h = '.'
+		self.filename = os.path.join(h, '.DhG-manifest.json')
+		self.db = db
+		self.config = [Config.Get(var) for var in Manifest.config_vars]
+		self.pages = {}					# Dependencies and signature of each page, indexed by file name
+		self.changed = False
+		self.person_digests = {}		# Cache of card hashes, indexed by uniq
+		self.template_digests = {}		# Cache of template file hashes, indexed by template name
+		return
+
+	# Read the manifest file.
+	# A missing, unreadable or out-of-date file results in an empty manifest.
+	#
+	def Load(self):
+		self.pages = {}
+		try:
+			with open(self.filename, 'r') as f:
+				m = json.load(f)
+		except FileNotFoundError:
+			return
+		except Exception:
+			print('Warning: manifest', self.filename, 'cannot be read; all files will be created')
+			return
+		if m.get('version') == Manifest.version and m.get('config') == self.config:
+			self.pages = m['pages']
+		return
+
+	# Write the manifest file if anything has changed
+	#
+	def Save(self):
+		if not self.changed:
+			return
+		tmpname = self.filename + '.tmp'
+		try:
+			d = os.path.dirname(self.filename)
+			if d != '':
+				os.makedirs(d, exist_ok=True)
+			with open(tmpname, 'w') as f:
+				json.dump({'version': Manifest.version, 'config': self.config, 'pages': self.pages}, f,
+							sort_keys=True)
+			os.replace(tmpname, self.filename)
+			self.changed = False
+		except Exception:
+			print('Warning: manifest', self.filename, 'cannot be written')
+			print(traceback.format_exc())
+		return
+
+	# Return True if a page exists, is unchanged since it was created and has the given dependencies
+	#
+	def IsUpToDate(self, file, deps):
+		try:
+			page = self.pages[file]
+			sig = list(Snapshot.GetSignature(file))
+		except (KeyError, OSError):
+			return False
+		return page['sig'] == sig and page['deps'] == deps
+
+	# Return True if a page exists, is unchanged since it was created and was created with the given
+	# quick key, and the transcript files that it includes are unchanged
+	#
+	def IsQuickUpToDate(self, file, quick):
+		try:
+			page = self.pages[file]
+			sig = list(Snapshot.GetSignature(file))
+		except (KeyError, OSError):
+			return False
+		deps = page['deps']
+		if page['sig'] != sig or deps.get('quick') != quick:
+			return False
+		for key in deps:
+			if key.startswith('filesig:') and deps[key] != self.GetFileSignature(key[8:]):
+				return False
+		return True
+
+	# Return the quick key of a page: a hash of the templates and of the cards of a list of persons.
+	# The list contains (uniq, extra) tuples, where extra is anything else that affects the page.
+	#
+	def GetQuickKey(self, tmpl_name, persons):
+		parts = [self.GetTemplateDigest('html-wrapper.tmpl'), self.GetTemplateDigest(tmpl_name)]
+		for (uniq, extra) in persons:
+			parts.append((uniq, self.GetPersonDigest(uniq), extra))
+		return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+	# Record the dependencies of a page that has just been created
+	#
+	def Update(self, file, deps):
+		try:
+			sig = list(Snapshot.GetSignature(file))
+		except OSError:
+			return
+		self.pages[file] = {'sig': sig, 'deps': deps}
+		self.changed = True
+		return
+
+	# Return the dependencies of a page as a dictionary of content hashes.
+	# The parameters are the template name and template parameters as passed to DoTemplate.
+	#
+	def GetDependencies(self, tmpl_name, tp):
+		deps = {}
+		if 'html' in tmpl_name:
+			deps['template:html-wrapper.tmpl'] = self.GetTemplateDigest('html-wrapper.tmpl')
+		deps['template:' + tmpl_name] = self.GetTemplateDigest(tmpl_name)
+
+		files = []
+		transcripts = {}
+		seen = set()
+		todo = [tp]
+		while len(todo) > 0:
+			o = todo.pop()
+			if id(o) in seen or o == None or isinstance(o, str) or isinstance(o, int):
+				continue
+			seen.add(id(o))
+			if isinstance(o, dict):
+				todo.extend(o.values())
+			elif isinstance(o, list) or isinstance(o, tuple):
+				todo.extend(o)
+			elif isinstance(o, T_Person):
+				if isinstance(o.uniq, int):
+					deps['person:' + str(o.uniq)] = self.GetPersonDigest(o.uniq)
+			elif isinstance(o, T_File):
+				files.append(o)
+			elif isinstance(o, T_Transcript):
+				transcripts[o.ref] = o
+			elif hasattr(o, '__slots__'):
+				todo.extend([getattr(o, name, None) for name in o.__slots__])
+			elif hasattr(o, '__dict__'):
+				todo.extend(vars(o).values())
+
+		# Transcript files are included in the page as T_Transcript objects
+		for fx in files:
+			if fx.tref != None and fx.tref in transcripts:
+				digest = hashlib.sha1(transcripts[fx.tref].text.encode()).hexdigest()
+			else:
+				digest = None
+			deps['file:' + fx.name] = digest
+			if digest != None:
+				deps['filesig:' + fx.name] = self.GetFileSignature(fx.name)
+		return deps
+
+	# Return the hash of a person's card as it was loaded into the database.
+	# The hash is made from the signature of the card file when it was read, not from the file as it is
+	# now, so that a card that has been edited but not reloaded is not taken to be up to date.
+	#
+	def GetPersonDigest(self, uniq):
+		try:
+			return self.person_digests[uniq]
+		except KeyError:
+			pass
+		if uniq < len(self.db.persons):
+			p = self.db.persons[uniq]
+		else:
+			p = None
+		if p == None:
+			digest = None
+		elif p.signature != None:
+			digest = hashlib.sha1(repr(p.signature).encode()).hexdigest()
+		else:
+			# No card file (e.g. imported from GEDCOM and not yet written)
+			digest = hashlib.sha1(repr(p.GetRecord()).encode()).hexdigest()
+		self.person_digests[uniq] = digest
+		return digest
+
+	# Return the signature of a transcript file, or None if the file can't be found
+	#
+	def GetFileSignature(self, fname):
+		path = Config.FindFile(fname, 'text_path', None)
+		if path == None:
+			return None
+		try:
+			return list(Snapshot.GetSignature(path))
+		except OSError:
+			return None
+
+	# Return the hash of the template that DoTemplate would use for a template name
+	#
+	def GetTemplateDigest(self, tmpl_name):
+		try:
+			return self.template_digests[tmpl_name]
+		except KeyError:
+			pass
+		digest = None
+		for loc in Config.Get('tmpl_path').split(':'):
+			t = os.path.join(loc, tmpl_name)
+			if os.path.exists(t):
+				with open(t, 'rb') as f:
+					digest = hashlib.sha1(f.read()).hexdigest()
+				break
+		self.template_digests[tmpl_name] = digest
+		return digest
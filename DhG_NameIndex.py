@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of DhG.
+#
+# DhG is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DhG is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DhG.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+
+# A class to hold an index of the names of the persons in the database
+#
+# The index maps each trigram (sequence of three characters) of the lower-case names to a list of the
+# unique IDs of the persons whose names contain the trigram. The lists are in order of unique ID.
+#
+# A search term can only occur in names that contain all the trigrams of the term, so the posting lists
+# of the trigrams give a small set of candidates. The candidates must still be checked with
+# Person.IsMatch(), because the trigrams of a term can occur in a name without the term itself.
+# Terms of fewer than three characters have no trigrams and do not restrict the candidates.
+#
+class NameIndex():
+	def __init__(self):
+		self.postings = {}			# List of uniq for each trigram, indexed by trigram
+		return
+
+	# Build the index for all the persons in a list. Entries that are None are ignored.
+	# The list must be in order of unique ID.
+	#
+	def Build(self, persons):
+		self.postings = {}
+		for p in persons:
+			if p != None and p.name != None:
+				for tg in NameIndex.GetTrigrams(p.name):
+					self.postings.setdefault(tg, []).append(p.uniq)
+		return
+
+	# Add a person to the index
+	#
+	def Add(self, p):
+		if p.name != None:
+			for tg in NameIndex.GetTrigrams(p.name):
+				bisect.insort(self.postings.setdefault(tg, []), p.uniq)
+		return
+
+	# Remove a person from the index
+	#
+	def Remove(self, p):
+		if p.name != None:
+			for tg in NameIndex.GetTrigrams(p.name):
+				try:
+					plist = self.postings[tg]
+				except KeyError:
+					continue
+				i = bisect.bisect_left(plist, p.uniq)
+				if i < len(plist) and plist[i] == p.uniq:
+					del plist[i]
+					if len(plist) == 0:
+						del self.postings[tg]
+		return
+
+	# Return a list of the unique IDs of the persons whose names might contain all the terms in a
+	# list, in order of unique ID. Returns None if none of the terms restricts the candidates.
+	#
+	def GetCandidates(self, terms):
+		trigrams = set()
+		for t in terms:
+			trigrams |= NameIndex.GetTrigrams(t)
+		if len(trigrams) == 0:
+			return None
+		plists = []
+		for tg in trigrams:
+			try:
+				plists.append(self.postings[tg])
+			except KeyError:
+				return []
+		plists.sort(key=len)
+		candidates = set(plists[0])
+		for plist in plists[1:]:
+			candidates.intersection_update(plist)
+			if len(candidates) == 0:
+				return []
+		return sorted(candidates)
+
+	# Return the set of trigrams of a string, ignoring case
+	#
+	@staticmethod
+	def GetTrigrams(s):
+		s = s.lower()
+		return set(s[i:i+3] for i in range(len(s) - 2))
@@ -35,7 +35,9 @@
 import os
 import sys
 from DhG_Config import Config
+from DhG_Date import Date
 from DhG_Event import Event
+from DhG_Snapshot import Snapshot
 from DhG_Template import T_Person
 
 evchars = set(['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', '?'])
@@ -44,8 +46,17 @@ evchars = set(['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', '?'])
 # Person class - represent a person in the database
 #
 class Person:
+	__slots__ = ('filename', 'headlines', 'event_list', 'events_loaded', 'footlines', 'name', 'uniq', 'sex',
+				'birth', 'death', 'private', 'calc_privacy', 'partnerships', 'father_name', 'father_uniq',
+				'mother_name', 'mother_uniq', 'importer_info', 'signature')
+
+	# Function that reloads a person whose card file has changed since it was read lazily (see LoadEvents()).
+	# It returns the reloaded person, or None. Set by the database.
+	reload_handler = None
+
 	def __init__(self):
 		self.filename = None
+		self.signature = None				# Signature of the card file when it was read (see Snapshot)
 		self.Clear()
 		return
 
@@ -53,7 +64,8 @@ class Person:
 	#
 	def Clear(self):
 		self.headlines = []
-		self.events = []
+		self.event_list = []				# The events; use the events property to access them
+		self.events_loaded = True			# False if only the vital events have been read (lazy loading)
 		self.footlines = []
 		self.name = None
 		self.uniq = None
@@ -70,27 +82,42 @@ class Person:
 		self.importer_info = None			# Used for storing extra information used by importers etc.
 		return
 
+	# The list of events.
+	# If the card file was read lazily, the full list of events is read and decoded the first time
+	# that it is needed.
+	#
+	@property
+	def events(self):
+		if not self.events_loaded:
+			self.LoadEvents()
+		return self.event_list
+
 	# Read and store all the data from a person's card file
+	# If lazy is True, only the first lines of the vital events (birth, death, marriage, partnership)
+	# are stored. The other events, the rest of the event lines and the footer are read on demand.
 	#
-	def ReadFile(self, filename):
+	def ReadFile(self, filename, lazy=False):
 		self.filename = filename
-		self.Read()
+		self.Read(lazy)
 		return
 
-	def Read(self):
+	def Read(self, lazy=False):
 		# Clear out any old stuff
 		self.Clear()
+		self.events_loaded = not lazy
 		mode = 0	# 0 = head, 1 = timeline, 2 = tail
 		cur_event = None
 		f = open(self.filename, 'r')
-		for line in f:
+		for (lineno, line) in enumerate(f, 1):
 			line = line.rstrip()	# Removes LF as well
 
 			if line.lower() == 'eof':				# Go straight to footer
 				if cur_event != None:				# Finish processing current event
-					self.events.append(cur_event)
+					self.event_list.append(cur_event)
 					cur_event = None
 				mode = 2
+				if lazy:
+					break
 
 			if mode == 0:
 				if line[0:1] in evchars:
@@ -101,25 +128,107 @@ class Person:
 			if mode == 1:
 				if line[0:1] in evchars:
 					if cur_event != None:
-						self.events.append(cur_event)
+						self.event_list.append(cur_event)
 					cur_event = Event()
-				cur_event.AddLine(line)
+					cur_event.lineno = lineno
+					cur_event.AddLine(line)
+					if lazy and not cur_event.IsVital():
+						cur_event = None
+				elif not lazy:
+					cur_event.AddLine(line)
 
 			if mode == 2:
 				self.footlines.append(line)
 
 		if cur_event != None:
-			self.events.append(cur_event)
+			self.event_list.append(cur_event)
 
 		f.close()
+
+		# The lines are never changed after reading, so store them compactly
+		self.headlines = tuple(self.headlines)
+		for e in self.event_list:
+			e.lines = tuple(e.lines)
 		return
 
+	# Read and decode the full list of events and the footer of a lazily-loaded card file.
+	# The header information is not changed.
+	#
+	# If the card file has changed since it was read, its events might not match the header, so the
+	# whole person is reloaded using reload_handler instead and this person takes its events from the
+	# reloaded person. If the card file can't be read or reloaded, this person is left without events.
+	#
+	def LoadEvents(self):
+		self.events_loaded = True
+		if self.filename == None:
+			return
+		try:
+			sig = Snapshot.GetSignature(self.filename)
+			if self.signature == None or sig == self.signature:
+				full = Person()
+				full.ReadFile(self.filename)
+		except OSError:
+			print('Warning:', self.filename, 'cannot be read; the events are not available')
+			self.event_list = []
+			return
+		reloaded = self.signature != None and sig != self.signature
+		if reloaded:
+			print('Warning:', self.filename, 'has changed since it was loaded; reloading')
+			full = None
+			if Person.reload_handler != None:
+				full = Person.reload_handler(self)
+			if full == None:
+				print('Warning:', self.filename, 'could not be reloaded; the events are not available')
+				self.event_list = []
+				return
+		self.event_list = full.events
+		self.footlines = full.footlines
+		self.birth = None
+		self.death = None
+		self.partnerships = []
+		if reloaded:
+			self.ClassifyEvents()			# Already decoded by the reload
+		else:
+			self.AnalyseEvents()
+		return
+
+	# Return a compact record of the person's parsed data, containing only built-in types.
+	# The record can be passed between processes and converted back using FromRecord().
+	# The records are also stored in the snapshot file. If you change the layout of the record,
+	# increment Snapshot.version.
+	#
+	def GetRecord(self):
+		if self.filename == None:
+			filename = None
+		else:
+			filename = str(self.filename)
+		events = []
+		for e in self.event_list:
+			events.append(e.GetRecord())
+		return (filename, self.headlines, self.footlines, self.name, self.uniq, self.sex, self.private,
+				self.father_name, self.father_uniq, self.mother_name, self.mother_uniq,
+				events, self.events_loaded)
+
+	# Create a person from a record returned by GetRecord()
+	# The header and events are not analysed again, so no warnings are repeated.
+	#
+	@staticmethod
+	def FromRecord(rec):
+		p = Person()
+		(p.filename, p.headlines, p.footlines, p.name, p.uniq, p.sex, p.private,
+				p.father_name, p.father_uniq, p.mother_name, p.mother_uniq,
+				events, p.events_loaded) = rec
+		for erec in events:
+			p.event_list.append(Event.FromRecord(erec, p))
+		p.ClassifyEvents()
+		return p
+
 	# Normalise a name string: remove leading and trailing whitespace, replace multiple whitespace with a single space
-	# Returns the normalised name
+	# Returns the normalised name. The name is interned, because the same names occur in many cards.
 	#
 	@staticmethod
 	def NormaliseName(name):
-		return ' '.join(name.split())
+		return sys.intern(' '.join(name.split()))
 
 	# Parse a combined name/id string in the form 'Forename Name Lastname [id]'
 	# Returns normalised name and id as a tuple.
@@ -167,12 +276,24 @@ class Person:
 			print(tag, 'tag found in', self.uniq)
 		return
 
+	# Report a problem found in the header.
+	# If problems is None the problem is printed, otherwise (index, message) is appended to problems.
+	#
+	def HeaderProblem(self, problems, index, msg):
+		if problems == None:
+			print(msg, 'in name:', self.name, 'uniq:', self.uniq)
+		else:
+			problems.append((index, msg))
+		return
+
 	# Extract the important information from the header lines:
 	# Name, Uniq, Sex, Father, Mother
+	# Problems are printed, or added to the problems list if given (see HeaderProblem()). The index of a
+	# problem is the index of the header line, which is the line number in the card file minus 1.
 	#
-	def AnalyseHeader(self):
+	def AnalyseHeader(self, problems=None):
 		cont_allowed = False
-		for line in self.headlines:
+		for (index, line) in enumerate(self.headlines):
 			line = line.lstrip()	# Remove leading spaces
 			if line == '' or line[0] == '#':
 				cont_allowed = False
@@ -181,7 +302,7 @@ class Person:
 				if cont_allowed:
 					pass
 				else:
-					print('Unexpected continuation line "'+line+'" ignored in name:', self.name, 'uniq:', self.uniq)
+					self.HeaderProblem(problems, index, 'Unexpected continuation line "'+line+'" ignored')
 			else:
 				cont_allowed = False
 				if line[0:5].lower() == 'name:':
@@ -238,7 +359,7 @@ class Person:
 					cont_allowed = True
 					pass
 				else:
-					print('Unrecognised header line: "'+line+'" ignored in name:', self.name, 'uniq:', self.uniq)
+					self.HeaderProblem(problems, index, 'Unrecognised header line: "'+line+'" ignored')
 		return
 
 	# Return True if person matches arguments
@@ -260,6 +381,13 @@ class Person:
 			return '?'
 		return self.birth.GetDate(fmt)
 
+	# Returns an integer for sorting persons by DoB. Unknown DoBs come last.
+	#
+	def GetDoBKey(self):
+		if self.birth == None:
+			return Date.unknown_key
+		return self.birth.GetDateKey()
+
 	# Returns DoD as a string
 	#
 	def GetDoD(self, fmt):
@@ -325,8 +453,14 @@ class Person:
 	# Analyse all the events for this person
 	#
 	def AnalyseEvents(self):
-		for e in self.events:
+		for e in self.event_list:
 			e.DecodeEventType(self)
+		self.ClassifyEvents()
+
+	# Find the birth, death and partnership events among the decoded events
+	#
+	def ClassifyEvents(self):
+		for e in self.event_list:
 			if e.etype != None:
 				typ = e.etype.lower()
 				if typ == 'birth':
@@ -347,7 +481,7 @@ class Person:
 			(sp_name, sp_uniq) = Person.ParseCombinedNameString(m.rest)
 			t = (m.date, sp_uniq)
 			p.append(t)
-		p = sorted(p, key=lambda xx: xx[0])
+		p = sorted(p, key=lambda xx: Date.SortKey(xx[0]))
 		return p
 
 	# Returns True if one or both parents is recorded in the database (not just as a name)
@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of DhG.
+#
+# DhG is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DhG is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DhG.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+from DhG_Date import Date
+
+# A class to hold an index of the relationships between the persons in the database
+#
+# The persons are grouped by their pair of parents (father's uniq, mother's uniq), so that each group holds
+# a set of full siblings. A parent that is not known by unique ID is None in the pair. Within a group the
+# persons are in order of date of birth and persons with the same date of birth are in order of unique ID.
+# For each parent the index also holds the pairs in which that parent appears, so that the children of a
+# person and the full and half siblings of a person are found by merging a few groups.
+#
+# For each person that has partnership events, the index holds the person's partners as a list of
+# (date, uniq, name) tuples in order of date, as they are written on the person's card. A partner that is
+# only known by name has None as uniq. The index also holds, for each person, the persons whose partnership
+# events refer to that person, which is the reverse of these references.
+#
+# For each pair of persons (a, b) where a's card has a partnership event that refers to b, the index holds
+# a list of (name, date) tuples, one for each such event, where name is b's name as written on a's card
+# and date is the date of the event. This allows a partnership to be checked against the partner's card
+# without searching the partner's events.
+#
+# The entries in the groups are (date-of-birth, uniq) tuples, where date-of-birth is the integer sort key
+# returned by Person.GetDoBKey(). An entry must be removed (using the same Person object) before the
+# person's parents or date of birth can change, otherwise the entry can't be found.
+#
+class Relations():
+	def __init__(self):
+		self.groups = {}			# List of (dob, uniq) for each pair of parents, indexed by (father, mother)
+		self.by_father = {}			# Set of parent pairs for each father, indexed by the father's uniq
+		self.by_mother = {}			# Set of parent pairs for each mother, indexed by the mother's uniq
+		self.partners = {}			# List of (date, uniq, name) for each person's partners, indexed by uniq
+		self.partner_refs = {}		# List of persons referring to each person as partner, indexed by uniq
+		self.spouses = {}			# List of (name, date) for each partnership, indexed by (uniq, partner's uniq)
+		return
+
+	# Build the index for all the persons in a list. Entries that are None are ignored.
+	#
+	def Build(self, persons):
+		self.groups = {}
+		self.by_father = {}
+		self.by_mother = {}
+		self.partners = {}
+		self.partner_refs = {}
+		self.spouses = {}
+		for p in persons:
+			if p != None:
+				self.GetGroup(p).append((p.GetDoBKey(), p.uniq))
+				self.AddPartners(p)
+		for group in self.groups.values():
+			group.sort()
+		return
+
+	# Add a person to the index
+	#
+	def Add(self, p):
+		bisect.insort(self.GetGroup(p), (p.GetDoBKey(), p.uniq))
+		self.AddPartners(p)
+		return
+
+	# Remove a person from the index
+	#
+	def Remove(self, p):
+		for (date, sp_uniq, sp_name) in self.partners.pop(p.uniq, []):
+			if sp_uniq == None:
+				continue
+			try:
+				self.partner_refs[sp_uniq].remove(p.uniq)
+			except (KeyError, ValueError):
+				pass
+			key = (p.uniq, sp_uniq)
+			try:
+				entries = self.spouses[key]
+				entries.remove((sp_name, date))
+				if len(entries) == 0:
+					del self.spouses[key]
+			except (KeyError, ValueError):
+				pass
+		key = (p.father_uniq, p.mother_uniq)
+		try:
+			group = self.groups[key]
+			group.remove((p.GetDoBKey(), p.uniq))
+		except (KeyError, ValueError):
+			return
+		if len(group) == 0:
+			del self.groups[key]
+			if key[0] != None:
+				self.by_father[key[0]].discard(key)
+			if key[1] != None:
+				self.by_mother[key[1]].discard(key)
+		return
+
+	# Add a person's partners and the references from the person to the partners
+	#
+	def AddPartners(self, p):
+		if len(p.partnerships) == 0:
+			return
+		partners = []
+		for ev in p.partnerships:
+			(sp_name, sp_uniq) = p.ParseCombinedNameStringX(ev.rest)
+			partners.append((ev.date, sp_uniq, sp_name))
+			if sp_uniq != None:
+				self.partner_refs.setdefault(sp_uniq, []).append(p.uniq)
+				self.spouses.setdefault((p.uniq, sp_uniq), []).append((sp_name, ev.date))
+		self.partners[p.uniq] = sorted(partners, key=lambda xx: Date.SortKey(xx[0]))
+		return
+
+	# Return a list of the (date, uniq, name) tuples for a person's partners, in order of date.
+	# The list must not be modified.
+	#
+	def GetPartners(self, uniq):
+		return self.partners.get(uniq, [])
+
+	# Return a list of the (name, date) tuples of the partnership events on a's card that refer to b
+	#
+	def GetSpouseEntries(self, a_uniq, b_uniq):
+		return self.spouses.get((a_uniq, b_uniq), [])
+
+	# Return the group for a person's pair of parents, creating it if necessary
+	#
+	def GetGroup(self, p):
+		key = (p.father_uniq, p.mother_uniq)
+		try:
+			return self.groups[key]
+		except KeyError:
+			pass
+		group = self.groups[key] = []
+		if key[0] != None:
+			self.by_father.setdefault(key[0], set()).add(key)
+		if key[1] != None:
+			self.by_mother.setdefault(key[1], set()).add(key)
+		return group
+
+	# Return a list of (uniq, (father, mother)) tuples for all the persons in a set of groups,
+	# in order of date of birth
+	#
+	def Merge(self, keys):
+		entries = []
+		for key in keys:
+			for (dob, uniq) in self.groups[key]:
+				entries.append((dob, uniq, key))
+		entries.sort()
+		return [(uniq, key) for (dob, uniq, key) in entries]
+
+	# Return a list of the unique IDs of the children of a person, in order of date of birth
+	#
+	def GetChildren(self, uniq):
+		keys = self.by_father.get(uniq, set()) | self.by_mother.get(uniq, set())
+		return [c_uniq for (c_uniq, key) in self.Merge(keys)]
+
+	# Return the siblings of a person, including the person, in order of date of birth.
+	# The siblings are those who have the same father or the same mother as the person, where the
+	# parent is known by unique ID. The result is a list of (uniq, (father, mother)) tuples. Half
+	# siblings are those whose (father, mother) pair differs from the person's.
+	#
+	def GetSiblings(self, p):
+		keys = set()
+		if p.father_uniq != None:
+			keys |= self.by_father.get(p.father_uniq, set())
+		if p.mother_uniq != None:
+			keys |= self.by_mother.get(p.mother_uniq, set())
+		return self.Merge(keys)
+
+	# Return a list of the unique IDs of the persons whose partnership events refer to a person
+	#
+	def GetPartnerRefs(self, uniq):
+		return self.partner_refs.get(uniq, [])
@@ -22,6 +22,7 @@ import sys
 import cmd
 import re
 import traceback
+import time
 import getopt
 
 from jinja2 import Template
@@ -30,6 +31,8 @@ from DhG_Database import Database
 from DhG_Person import Person
 from DhG_Config import Config
 from DhG_Template import DoTemplate
+from DhG_Watcher import Watcher
+from DhG_Generator import HtmlGenerator
 
 # A class to implement a command interpreter for the interactive DhG
 #
@@ -66,6 +69,9 @@ class DhG_Shell(cmd.Cmd):
 	# The database
 	db = None
 
+	# The background thread that watches the card files for changes
+	watcher = None
+
 	# Configuration variables can be set in the config file
 	prompt = '(DhG) '	# Parent class needs a copy
 
@@ -129,6 +135,37 @@ class DhG_Shell(cmd.Cmd):
 			print('Type help or ? to list commands.')
 		self.db = Database(Config.Get('db_dir'))
 		self.db.Reload()
+		self.StartWatcher()
+
+	# Start the card file watcher if configured, stopping the old one if there is one.
+	#
+	def StartWatcher(self):
+		if self.watcher != None:
+			self.watcher.Stop()
+			self.watcher = None
+		interval = Config.Get('watch_interval')
+		if interval != None and interval > 0:
+			self.watcher = Watcher(self.db.basepath, interval, self.db.GetCardSignatures())
+			self.watcher.start()
+		return
+
+	# Tell the card file watcher, if any, which card files the database has loaded, after the shell
+	# has reloaded some itself
+	#
+	def SyncWatcher(self):
+		if self.watcher != None:
+			self.watcher.SetSignatures(self.db.GetCardSignatures())
+		return
+
+	# Apply any changes to the card files that the watcher has found
+	#
+	def ApplyWatchedChanges(self):
+		if self.watcher == None:
+			return
+		sigs = self.watcher.TakeChanges()
+		if sigs != None:
+			self.db.ReloadChanged(sigs, quiet = True)
+		return
 
 	def onecmd(self, str):
 		try:
@@ -167,13 +204,15 @@ class DhG_Shell(cmd.Cmd):
 				cmdmatch.append(name[3:])
 		return cmdmatch
 
-	# Preprocess the command: try to find a match for an abbreviated command.
+	# Preprocess the command: apply any changes found by the watcher, then try to find a match
+	# for an abbreviated command.
 	# If there's no match, change the line to "zz_error_no_command" followed by the abbreviation.
 	# If there's more than one match, change the line to "zz_error_ambiguous_command" follwed by
 	# a list of commands that match (space-separated).
 	# This means that, if necessary, the emptyline() function can do something useful.
 	#
 	def precmd(self, line):
+		self.ApplyWatchedChanges()
 		line = line.rstrip().lstrip()
 #		print('precmd():', line)
 		if line == '':
@@ -202,6 +241,28 @@ class DhG_Shell(cmd.Cmd):
 				line = line + ' ' + m
 		return line
 
+	# Return a list of the persons listed in a file.
+	# Each line of the file identifies a person by the first word, which is normally the unique ID.
+	# Blank lines and lines starting with '#' are ignored. Lines that don't identify exactly one person
+	# are reported.
+	#
+	def ReadPersonFile(self, filename):
+		persons = []
+		f = open(filename, 'r')
+		for line in f:
+			line = line.rstrip().lstrip()
+			id = line.split(' ')[0]
+			if id == '' or id[0] == '#':
+				pass			# Ignore comment lines and blank lines
+			else:
+				l = self.db.GetMatchingPersons(id)
+				if len(l) == 1:
+					persons.append(l[0])
+				else:
+					print('Invalid or ambiguous line "'+line+'" found in', filename)
+		f.close()
+		return persons
+
 	# Print a list of all the persons in the database.
 	#
 	def PrintPersonList(self, l, arg):
@@ -220,6 +281,7 @@ class DhG_Shell(cmd.Cmd):
 			print('Editing', os.path.basename(l[0].filename))
 			os.system(editor + ' ' + str(l[0].filename))
 			self.db.ReloadPerson(l[0].uniq)
+			self.SyncWatcher()
 		else:
 			self.PrintPersonList(l, arg)
 		return
@@ -301,6 +363,8 @@ Configuration parameters:
    branch       - The current family branch, if any.
       This parameter adds an extra subdirectory level the path used by the "new" command.
 
+   bytecode_cache - A directory in which to store the compiled templates between sessions.
+
    dateformat   - The date format to use in most interactive queries.
       raw      - Exactly as given in the card file.
       cooked   - Converts the symbols <, > abd ~ to text, converts Qn to the middle month with "abt."
@@ -320,10 +384,29 @@ Configuration parameters:
 		
    html_dir     - The directory in which to place the generated HTML files.
 
+   html_jobs    - The number of worker processes to use for "htmlcard @all" and "htmlcard @public".
+      1 creates the cards serially. 0 uses one process per CPU.
+
+   incremental  - "y" creates only the HTML files whose content has changed since they were last created.
+
+   lazy_load    - "y" reads only the header and vital events at startup; the rest is read when needed.
+
+   load_jobs    - The number of worker processes to use when loading the database.
+      1 loads the card files serially. 0 uses one process per CPU.
+
    prompt       - The prompt to display when DhG2 can accept a command.
 
    server_path  - The base path to use for local links in the generated HTML files.
 
+   site_ancestors   - A file listing the persons whose ancestor trees the "htmlsite" command creates.
+
+   site_descendants - A file listing the persons whose descendant trees the "htmlsite" command creates.
+
+   skip_unchanged - "y" leaves existing files untouched if the only difference is the timestamp.
+
+   snapshot_file - A file in which to store the parsed database between sessions.
+      Card files that have not changed since the snapshot was written are not parsed again.
+
    text-suffix  - The suffix of transcript files that can be included verbatim in generated HTML files.
 
    text_path    - The directory in which text transcripts can be found.
@@ -331,6 +414,9 @@ Configuration parameters:
 
    tmpl_path    - The list of directories to search for templates.
       The individual directories are separated using ":".
+
+   watch_interval - The number of seconds between checks for card files changed outside DhG2.
+      Changes are loaded before the next command. 0 disables the check.
 		''')
 		return
 
@@ -432,6 +518,8 @@ Type "help config" to see a list of the configuration parameters.
 			return
 		if not Config.SetParameter(arg):
 			print('Error : invalid syntax for the set command')
+		elif self.watcher == None or self.watcher.interval != Config.Get('watch_interval'):
+			self.StartWatcher()
 		return
 
 	# ======================================
@@ -439,17 +527,39 @@ Type "help config" to see a list of the configuration parameters.
 	#
 	def do_reload(self, arg):
 		'''
-The "reload" command reloads the entire database from the card files into memory.
+The "reload" command reloads the database from the card files into memory.
 
 Normally you should not need to do this. The command is useful if you
-edit many card files outside of a running DhG2 process.
+edit many card files outside of a running DhG2 process, for example by
+updating your database from a revision control system.
 Hint: if you edit a single card file it might be quicker just to open
 the file within DhG2 and close it without making changes.
 
 Usage:
-   reload  - Reloads the database. Parameters are ignored.
+   reload       - Reloads the card files that have been added, modified or deleted since the last load.
+   reload full  - Reloads the entire database.
 		'''
-		self.db.Reload()
+		if arg.strip().lower() == 'full' or len(self.db.cards) == 0:
+			self.db.Reload()
+		else:
+			self.db.ReloadChanged()
+		self.SyncWatcher()
+		return
+
+	# ======================================
+	# Implementation of the "memory" command
+	#
+	def do_memory(self, arg):
+		'''
+The "memory" command displays the amount of memory used by the persons in the database.
+
+For comparison, the command also shows an estimate of the memory that would be needed if the
+persons and events were stored in the less compact form used by earlier versions of DhG2.
+
+Usage:
+   memory  - Displays the memory used by the database. Parameters are ignored.
+		'''
+		self.db.MemoryReport()
 		return
 
 	# ======================================
@@ -579,6 +689,7 @@ Usage:
 	def do_edit(self, arg):
 		'''
 The "edit" command edits a person's card file using your configured editor.
+When the editor exits, the card is reloaded and the references to and from the person are verified.
 
 Usage:
    edit <person>  - Invokes your configured editor to edit the person's card file.
@@ -730,13 +841,58 @@ exist and have the same name as the reference. The verification applies to paren
 but not to other people like witnesses, where the name given in the record might differ from
 their official name.
 
+The "verify relations" command checks the relationship index that is used to find children,
+siblings and partners against a scan of all the persons in the database.
+
 Usage:
-   verify  -- Verify the person references in the database. Parameters are ignored.
-		'''
-		if self.db.VerifyRefs() == 0:
+   verify            -- Verify the person references in the database.
+   verify relations  -- Check the relationship index against the persons in the database.
+		'''
+		if arg.strip().lower() == 'relations':
+			t0 = time.time()
+			n_diffs = self.db.CheckRelations()
+			print('Relationship index check complete;', n_diffs, 'differences',
+					'(%.2f seconds)' % (time.time() - t0))
+		elif len(self.db.VerifyRefs()) == 0:
 			print('Verification complete; no errors')
 		return
 
+	# =====================================
+	# Implementation of the "lint" command.
+	#
+	def do_lint(self, arg):
+		'''
+The "lint" command checks the structure of every card file in the database directory: the header
+lines, the form of the event lines and the information and sources within the events. These are
+the checks that are otherwise only made when the cards are loaded or the HTML cards are created.
+No HTML files are created. The card files are read again, so changes that have not been reloaded
+are checked too. The "load_jobs" configuration variable controls the number of worker processes.
+
+Each problem is reported on a line of the form FILE:LINE: PROBLEM, sorted by file and line.
+
+Usage:
+   lint             - Print the problems.
+   lint <filename>  - Write the problems to <filename>.
+		'''
+		t0 = time.time()
+		problems = self.db.Lint()
+		lines = [path + ':' + str(line) + ': ' + problem for (path, line, problem) in problems]
+		if arg == '':
+			for line in lines:
+				print(line)
+		else:
+			try:
+				f = open(os.path.expanduser(arg), 'w')
+				for line in lines:
+					print(line, file=f)
+				f.close()
+			except OSError as e:
+				print('Cannot write', arg, ':', e)
+				return
+		nfiles = len(set(path for (path, line, problem) in problems))
+		print('Lint: %d problems in %d card files (%.2f seconds)' % (len(problems), nfiles, time.time() - t0))
+		return
+
 	# ==========================================
 	# Implementation of the "gedimport" command.`
 	#
@@ -815,33 +971,23 @@ Usage:
    htmldescendants <person>   - Creates a descendants tree in HTML for <person>.
    htmldescendants @filename  - Creates a descendants tree in HTML for each person listed in the specified file.
 		'''
+		generator = HtmlGenerator(self.db)
 		if len(arg) > 0 and arg[0] == '@':
-			f = open(arg[1:], 'r')
-			erase = '          '
-			lastlen = 0
-			for line in f:
-				line = line.rstrip().lstrip()
-				id = line.split(' ')[0]
-				if id == '' or id[0] == '#':
-					pass			# Ignore comment lines and blank lines
-				else:
-					l = self.db.GetMatchingPersons(id)
-					if len(l) == 1:
-						person = l[0]
-						print('HTML descendants for', person.GetVitalLine())
-						file = Config.MakeHtmlDescTreeName(person.name, person.uniq)
-						desc = self.db.GetDescendants(person.uniq, 'yearonly')
-						DoTemplate('descendant-tree-html.tmpl', desc, file, trim = True)
-					else:
-						print('Invalid or ambiguous line "'+line+'" found in', arg[1:])
-			f.close()
+			self.db.StartDescendantCache()
+			try:
+				for person in self.ReadPersonFile(arg[1:]):
+					print('HTML descendants for', person.GetVitalLine())
+					generator.CreateDescendantTree(person)
+			finally:
+				self.db.StopDescendantCache()
+			if Config.Get('incremental') == 'y' or Config.Get('skip_unchanged') == 'y':
+				generator.PrintSummary('HTML trees')
+			generator.Finish()
 			return
 		l = self.db.GetMatchingPersons(arg)
 		if len(l) == 1:
-			person = l[0]
-			file = Config.MakeHtmlDescTreeName(person.name, person.uniq)
-			desc = self.db.GetDescendants(person.uniq, 'yearonly')
-			DoTemplate('descendant-tree-html.tmpl', desc, file, trim = True)
+			generator.CreateDescendantTree(l[0])
+			generator.Finish()
 		else:
 			self.PrintPersonList(l, arg)
 		return
@@ -871,37 +1017,27 @@ The "htmlancestors" command creates an ancestors tree (also known as an Ahnentaf
 for the specified person or persons.
 The HTML file is called trees/FULLNAME-ID-ancestors.html and is placed in the configured HTML directory.
 
+The depth of the tree is limited to the value of the "depth" configuration parameter. If an ancestor
+appears more than once in the tree, the ancestor's own ancestors are only shown the first time; later
+appearances are marked with an arrow.
+
 Usage:
    htmlancestors <person>   - Creates an ancestor tree in HTML for <person>.
    htmlancestors @filename  - Creates an ancestor tree in HTML for each person listed in the specified file.
 		'''
+		generator = HtmlGenerator(self.db)
 		if len(arg) > 0 and arg[0] == '@':
-			f = open(arg[1:], 'r')
-			erase = '          '
-			lastlen = 0
-			for line in f:
-				line = line.rstrip().lstrip()
-				id = line.split(' ')[0]
-				if id == '' or id[0] == '#':
-					pass			# Ignore comment lines and blank lines
-				else:
-					l = self.db.GetMatchingPersons(id)
-					if len(l) == 1:
-						person = l[0]
-						print('HTML ancestors for', person.GetVitalLine())
-						file = Config.MakeHtmlAncTreeName(person.name, person.uniq)
-						anc = self.db.GetAncestors(person.uniq, 'yearonly')
-						DoTemplate('ancestor-tree-html.tmpl', anc, file, trim = True)
-					else:
-						print('Invalid or ambiguous line "'+line+'" found in', arg[1:])
-			f.close()
+			for person in self.ReadPersonFile(arg[1:]):
+				print('HTML ancestors for', person.GetVitalLine())
+				generator.CreateAncestorTree(person)
+			if Config.Get('incremental') == 'y' or Config.Get('skip_unchanged') == 'y':
+				generator.PrintSummary('HTML trees')
+			generator.Finish()
 			return
 		l = self.db.GetMatchingPersons(arg)
 		if len(l) == 1:
-			person = l[0]
-			file = Config.MakeHtmlAncTreeName(person.name, person.uniq)
-			anc = self.db.GetAncestors(person.uniq, 'yearonly')
-			DoTemplate('ancestor-tree-html.tmpl', anc, file, trim = True)
+			generator.CreateAncestorTree(l[0])
+			generator.Finish()
 		else:
 			self.PrintPersonList(l, arg)
 		return
@@ -923,6 +1059,74 @@ Usage:
 		self.do_htmlancestors(arg)
 		return
 
+	# =========================================
+	# Implementation of the "htmlsite" command.
+	#
+	def do_htmlsite(self, arg):
+		'''
+The "htmlsite" command creates the complete HTML site in one go:
+   * the HTML card files (for all persons that are not private, or for all persons if generate=all)
+   * the surname index
+   * descendant trees for the persons listed in the file given by the site_descendants configuration variable
+   * ancestor trees for the persons listed in the file given by the site_ancestors configuration variable
+
+The privacy and the basic information about every person are calculated once and shared by all the
+stages. At the end, the time taken by each stage is displayed.
+
+Usage:
+   htmlsite  - Creates the complete HTML site. Parameters are ignored.
+		'''
+		public = (Config.Get('generate') == 'public')
+		stages = []
+		t_start = time.time()
+
+		if public:
+			t0 = time.time()
+			self.CalculatePrivacy()
+			stages.append(('privacy', time.time() - t0))
+
+		t0 = time.time()
+		self.db.FillTPersonCache('yearonly')
+		self.db.StartDescendantCache()
+		stages.append(('persons', time.time() - t0))
+		try:
+			t0 = time.time()
+			uniqs = []
+			for person in filter(lambda x: x != None, self.db.persons):
+				if not public or self.db.IsPublic(person.uniq):
+					uniqs.append(person.uniq)
+			HtmlGenerator(self.db).GenerateCards(uniqs, self.watcher)
+			stages.append(('cards', time.time() - t0))
+
+			t0 = time.time()
+			generator = HtmlGenerator(self.db)
+			file = Config.MakeHtmlSurnameIndexName()
+			info = self.db.GetSurnameIndexInfo(not public, 'yearonly')
+			generator.CreatePage('surname-index-html.tmpl', info, file)
+			generator.Finish()
+			stages.append(('index', time.time() - t0))
+
+			for (what, cfgvar) in [('descendants', 'site_descendants'), ('ancestors', 'site_ancestors')]:
+				listfile = Config.Get(cfgvar)
+				if listfile != None and listfile != '':
+					t0 = time.time()
+					generator = HtmlGenerator(self.db)
+					for person in self.ReadPersonFile(os.path.expanduser(listfile)):
+						if what == 'descendants':
+							generator.CreateDescendantTree(person)
+						else:
+							generator.CreateAncestorTree(person)
+					generator.PrintSummary('HTML ' + what + ' trees')
+					generator.Finish()
+					stages.append((what, time.time() - t0))
+		finally:
+			self.db.StopDescendantCache()
+
+		print('HTML site created in %.2f seconds:' % (time.time() - t_start))
+		for (stage, t) in stages:
+			print('   %-12s %8.2f seconds' % (stage, t))
+		return
+
 	# =========================================
 	# Implementation of the "htmlcard" command.
 	#
@@ -935,40 +1139,32 @@ Usage:
    htmlcard <person>  - Creates an HTML card file for <person>.
    htmlcard @all      - Creates HTML card files for all persons in the database.
    htmlcard @public   - Creates HTML card files for all persons that are not designated as private. 
+
+For @all and @public the cards are created by the number of processes given by the html_jobs
+configuration variable. A summary is printed at the end.
 		'''
 		if len(arg) > 0 and arg[0] == '@':
 			listfile = arg[1:]
 			# Special cases of listfile
 			if listfile == 'all' or listfile == 'public':
-				erase = '          '
-				lastlen = 0
+				if listfile == 'public' or Config.Get('generate') == 'public':
+					self.CalculatePrivacy()
+				uniqs = []
 				for person in filter(lambda x: x != None, self.db.persons):
 					if listfile == 'all' or self.db.IsPublic(person.uniq):
-						# Erase the previous line
-#						if lastlen > 0:
-#							while len(erase) < lastlen:
-#								erase += '     '
-#							print('HTML card for', erase[0:lastlen], end='\r')
-#						print('HTML card for', person.GetVitalLine(), end='\r')
-#						lastlen = len(person.GetVitalLine())
-						print('HTML card for', person.GetVitalLine())
-						try:
-							file = Config.MakeHtmlPersonCardName(person.name, person.uniq)
-							info = self.db.GetPersonCardInfo(person, 'yearonly')
-							DoTemplate('person-card-html.tmpl', info, file, trim = True)
-						except Exception:
-							print()
-							print(traceback.format_exc())
-				print()
+						uniqs.append(person.uniq)
+				HtmlGenerator(self.db).GenerateCards(uniqs, self.watcher)
 			else:
 				print('Printing cards of list of persons is not supported yet')
 			return
 		l = self.db.GetMatchingPersons(arg)
 		if len(l) == 1:
 			person = l[0]
+			generator = HtmlGenerator(self.db)
 			file = Config.MakeHtmlPersonCardName(person.name, person.uniq)
 			info = self.db.GetPersonCardInfo(person, 'yearonly')
-			DoTemplate('person-card-html.tmpl', info, file, trim = True)
+			generator.CreatePage('person-card-html.tmpl', info, file)
+			generator.Finish()
 		else:
 			self.PrintPersonList(l, arg)
 		return
@@ -1010,9 +1206,13 @@ Usage:
 			else:
 				print('Argument must be either @public or @all')
 				return
+		if not private:
+			self.CalculatePrivacy()
+		generator = HtmlGenerator(self.db)
 		file = Config.MakeHtmlSurnameIndexName()
 		info = self.db.GetSurnameIndexInfo(private, 'yearonly')
-		DoTemplate('surname-index-html.tmpl', info, file, trim = True)
+		generator.CreatePage('surname-index-html.tmpl', info, file)
+		generator.Finish()
 		return
 
 	# ===================================
@@ -1030,6 +1230,13 @@ Usage:
 		self.do_htmlindex(arg)
 		return
 
+	# Calculate the privacy of the whole database before generating public HTML files
+	#
+	def CalculatePrivacy(self):
+		(n_private, n_public, t) = self.db.CalculatePrivacy()
+		print('Privacy:', n_private, 'private,', n_public, 'public', '(%.2f seconds)' % t)
+		return
+
 	# =============================================
 	# Implementation of the "clearprivacy" command.
 	#
@@ -1039,7 +1246,8 @@ The "clearprivacy" command clears the calculated privacy of all persons in the d
 Calculating the privacy status for a large database is a time-consuming process, so once
 calculated the value is stored. However, explicitly changing a person's privacy by setting
 the person to private or deleting their death record might affect other persons' status
-too.
+too. Reloading an edited card clears the calculated privacy of the persons whose status
+might depend on the card, so this command is only needed in unusual cases.
 
 Usage:
    clearprivacy  - Clears the calculated privacy status for the whole database. Parameters are ignored.
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of DhG.
+#
+# DhG is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DhG is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DhG.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import pickle
+import traceback
+
+# A class to hold a snapshot of the parsed card files
+#
+# The snapshot is a single file containing, for each card file, the size and modification time of the
+# card file along with the parsed record (see Person.GetRecord()) and any messages that were printed
+# while parsing. When the database is loaded, a card whose size and modification time are unchanged
+# is taken from the snapshot instead of being read and analysed again.
+#
+# The version number must be incremented whenever the layout of the records changes. A snapshot with a
+# different version number is discarded and all the cards are parsed again. The same happens if the key
+# differs. The key identifies the database and any options that affect the parsing.
+#
+class Snapshot():
+	version = 2
+
+	def __init__(self, filename, key):
+		self.filename = os.path.expanduser(filename)
+		self.key = key
+		self.old = {}				# Entries read from the snapshot file: path --> (sig, rec, msgs)
+		self.new = {}				# Entries for the cards found in the current load
+		self.changed = False		# True if the snapshot file needs to be rewritten
+		return
+
+	# Return the signature (size and modification time) of a file
+	#
+	@staticmethod
+	def GetSignature(path):
+		st = os.stat(path)
+		return (st.st_size, st.st_mtime_ns)
+
+	# Read the snapshot file.
+	# A missing, unreadable or out-of-date file results in an empty snapshot.
+	#
+	def Load(self):
+		self.old = {}
+		try:
+			with open(self.filename, 'rb') as f:
+				(version, key, cards) = pickle.load(f)
+		except FileNotFoundError:
+			return
+		except Exception:
+			print('Warning: snapshot', self.filename, 'cannot be read; all cards will be parsed')
+			return
+		if version == Snapshot.version and key == self.key:
+			self.old = cards
+		return
+
+	# Return the (path, rec, msgs) tuple for a card if the card's signature is unchanged since the
+	# snapshot was made, otherwise None
+	#
+	def Lookup(self, path, sig):
+		key = str(path)
+		if sig == None:
+			return None
+		try:
+			(old_sig, rec, msgs) = self.old[key]
+		except KeyError:
+			return None
+		if old_sig != sig:
+			return None
+		self.new[key] = (sig, rec, msgs)
+		return (path, rec, msgs)
+
+	# Store the result of parsing a card in the snapshot
+	#
+	def Store(self, path, sig, rec, msgs):
+		key = str(path)
+		if sig == None:
+			return
+		self.new[key] = (sig, rec, msgs)
+		self.changed = True
+		return
+
+	# Write the snapshot file if anything has changed since it was read.
+	# The file is written under a temporary name and then renamed, so that an interrupted write
+	# cannot leave a damaged snapshot behind.
+	#
+	def Save(self):
+		if not self.changed and len(self.new) == len(self.old):
+			return
+		tmpname = self.filename + '.tmp'
+		try:
+			d = os.path.dirname(self.filename)
+			if d != '':
+				os.makedirs(d, exist_ok=True)
+			with open(tmpname, 'wb') as f:
+				pickle.dump((Snapshot.version, self.key, self.new), f, protocol=pickle.HIGHEST_PROTOCOL)
+			os.replace(tmpname, self.filename)
+		except Exception:
+			print('Warning: snapshot', self.filename, 'cannot be written')
+			print(traceback.format_exc())
+		return
@@ -78,48 +78,37 @@ The output shows the person and the source. Thus a person may result in multiple
 		l = self.db.GetMatchingPersons('')
 		for p in l:
 			for e in p.events:
-				source = None
-				has_image = False
-				has_transcript = False
-				for line in e.lines:
-					if len(line) < 1:
-						pass
-					elif line[0] == '+':
-						if source != None and has_image and not has_transcript:
-							print(p.GetVitalLine(), e.date, e.etype, source)
-						source = None
-						has_image = False
-						has_transcript = False
-						fields = line.split(maxsplit=4)
-						if ( len(fields) >= 4 and
-						     fields[0].lower() == '+source' and
-						     fields[1].lower() == 'census' and
-						     fields[2].lower() == 'record' and
-							 ( fields[3][0:2] == 'RG' or fields[3][0:5] == 'HO107' ) ):
-							if ew_census:
-								source = line
-						elif (len(fields) >= 1 and
-						      fields[0].lower() == '+source'):
-							if not ew_census:
-								source = line
-						else:
-							source = None
-					elif line[0] == '-':
-						fields = line.split(maxsplit=4)
-						if len(fields) > 2 and fields[0].lower() == '-file':
-							if fields[1].lower() == 'image':
+				for item in e.GetModel():
+					if item[0] != 'source':
+						continue
+					(kind, index, descr, entries) = item
+					fields = descr.split(maxsplit=3)
+					if ( len(fields) >= 3 and
+					     fields[0].lower() == 'census' and
+					     fields[1].lower() == 'record' and
+						 ( fields[2][0:2] == 'RG' or fields[2][0:5] == 'HO107' ) ):
+						if not ew_census:
+							continue
+					elif ew_census:
+						continue
+					has_image = False
+					has_transcript = False
+					for entry in entries:
+						if entry[0] == 'file':
+							if entry[2].lower() == 'image':
 								has_image = True
-							elif fields[1].lower() == 'transcript':
-								(base, ext) = os.path.splitext(fields[2])
+							elif entry[2].lower() == 'transcript':
+								fname = entry[3].split(maxsplit=1)[0]
+								(base, ext) = os.path.splitext(fname)
 								if ext == '' or ext[0] != '.':
 									pass
 								elif ext[1:] in Config.Get('text-suffix').split(':'):
 									has_transcript = True
-						elif fields[0].lower() == '-transcript':
+						elif entry[0] == 'transcript':
 							if not strict:
 								has_transcript = True
-				if source != None and has_image and not has_transcript:
-					print(p.GetVitalLine(), e.date, e.etype, source)
+					if has_image and not has_transcript:
+						print(p.GetVitalLine(), e.date, e.etype, e.lines[index])
 		return
 
 if __name__ == '__main__':
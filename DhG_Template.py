@@ -19,8 +19,10 @@
 
 import os
 import sys
+import re
+import hashlib
 
-from jinja2 import Environment, BaseLoader
+from jinja2 import Environment, BaseLoader, TemplateNotFound, FileSystemBytecodeCache
 from time import strftime, gmtime
 from DhG_Config import Config
 
@@ -42,15 +44,76 @@ class DhG_Loader(BaseLoader):
 				return t
 		raise TemplateNotFound(template)
 
+	# Return the source of a template.
+	# The template is up to date as long as the same file would be found and it has not been modified.
+	#
 	def get_source(self, environment, template):
 		t = self.find_first(template)
 		mtime = os.path.getmtime(t)
 		with open(t) as f:
 			source = f.read()
-		return source, t, lambda: mtime == getmtime(path)
+
+		def uptodate():
+			try:
+				return self.find_first(template) == t and os.path.getmtime(t) == mtime
+			except (TemplateNotFound, OSError):
+				return False
+
+		return source, t, uptodate
+
+# The Jinja environments, indexed by (tmpl_path, trim, bytecode_cache).
+# An environment keeps the compiled templates, so each template is only compiled once per process.
+#
+environments = {}
+
+# Return the Jinja environment for the current configuration, creating it if necessary.
+# If the bytecode_cache configuration variable is set, the compiled templates are also stored in
+# that directory, so that they need not be compiled again by the next DhG2 session.
+#
+def GetEnvironment(trim):
+	tmpl_path = Config.Get('tmpl_path')
+	cache_dir = Config.Get('bytecode_cache')
+	key = (tmpl_path, trim, cache_dir)
+	try:
+		return environments[key]
+	except KeyError:
+		pass
+	bcc = None
+	if cache_dir != None and cache_dir != '':
+		cache_dir = os.path.expanduser(cache_dir)
+		try:
+			os.makedirs(cache_dir, exist_ok=True)
+			bcc = FileSystemBytecodeCache(cache_dir)
+		except OSError:
+			print('Warning: bytecode cache', cache_dir, 'cannot be created')
+	env = Environment(trim_blocks=trim, lstrip_blocks=trim, loader=DhG_Loader(tmpl_path), bytecode_cache=bcc)
+	environments[key] = env
+	return env
+
+# The generation timestamp in the form that DoTemplate provides
+#
+timestamp_re = re.compile(r'\d{4}-\d\d-\d\d \d\d:\d\d UTC')
+
+# Return a hash of the content of a file, ignoring anything that looks like a timestamp.
+# Returns None if the file can't be read.
+#
+def GetContentDigest(filename):
+	h = hashlib.sha1()
+	try:
+		with open(filename, 'r', newline='\n') as f:
+			for line in f:
+				h.update(timestamp_re.sub('', line).encode())
+	except (OSError, UnicodeDecodeError):
+		return None
+	return h.hexdigest()
 
 # A class to create a file from a template
 #
+# If the skip_unchanged configuration variable is 'y' and the output file already exists with the same
+# content, apart from the timestamp, the file is not written. This keeps the modification time of the
+# file, so that tools like rsync can tell that it has not changed. The attribute "written" tells whether
+# the file was written.
+#
 class DoTemplate():
 
 	# Do everything in the constructor
@@ -60,26 +123,42 @@ class DoTemplate():
 	#	out			= output file. None ==> stdout
 	#
 	def __init__(self, tmpl_name, tp, out, trim=False):
+		self.written = False
 		tp['config'] = Config
-		tp['timestamp'] = strftime('%Y-%m-%d %H:%M UTC', gmtime())
+		if 'timestamp' not in tp:
+			tp['timestamp'] = strftime('%Y-%m-%d %H:%M UTC', gmtime())
 		tp['tmpl_name'] = tmpl_name
-		env = Environment(trim_blocks=trim, lstrip_blocks=trim, loader=DhG_Loader(Config.Get('tmpl_path')))
+		env = GetEnvironment(trim)
 		if 'html' in tmpl_name:
 			template = env.get_template('html-wrapper.tmpl')
 		else:
 			template = env.get_template(tmpl_name)
-		out_text = template.render(tp = tp)
 		if out == None:
-			print(out_text)
+			print(template.render(tp = tp))
 		else:
+			if os.path.dirname(out) != '':
+				os.makedirs(os.path.dirname(out), exist_ok=True)
+			# Write the output as it is generated instead of creating the whole text in memory.
+			# The output is written under a temporary name and then renamed, so that a failure part way
+			# through does not leave an incomplete file behind.
+			tmpname = out + '.tmp'
 			try:
-				os.makedirs(os.path.dirname(out))
-			except FileExistsError:
-				pass
-			outfile = open(out, 'w', newline='\n')
-			outfile.write(out_text)
-			outfile.write('\n')
-			outfile.close()
+				with open(tmpname, 'w', newline='\n', buffering=65536) as outfile:
+					for chunk in template.generate(tp = tp):
+						outfile.write(chunk)
+					outfile.write('\n')
+				if Config.Get('skip_unchanged') == 'y' and os.path.exists(out) and \
+						GetContentDigest(tmpname) == GetContentDigest(out):
+					os.remove(tmpname)
+				else:
+					os.replace(tmpname, out)
+					self.written = True
+			except BaseException:
+				try:
+					os.remove(tmpname)
+				except OSError:
+					pass
+				raise
 		return
 
 # A class to hold basic information about a person
@@ -87,6 +166,8 @@ class DoTemplate():
 # See person-card-html.tmpl for details
 #
 class T_Person():
+	__slots__ = ('name', 'uniq', 'dob_dod', 'file', 'other', 'vital')
+
 	def __init__(self, name, uniq, dob_dod = None, file = None, other = None):
 		self.name = name			# Person's name
 		self.uniq = uniq			# Person's id
@@ -100,6 +181,14 @@ class T_Person():
 			self.vital = name + ' ' + dob_dod
 		return
 
+	# Return a copy of the object
+	#
+	def Copy(self):
+		tp = T_Person.__new__(T_Person)
+		for a in T_Person.__slots__:
+			setattr(tp, a, getattr(self, a))
+		return tp
+
 # A class to hold a subtree of a descendants tree
 # Used in templates
 # See descendant-tree-html.tmpl for details
@@ -124,11 +213,43 @@ class T_Descendants():
 				x.debug_print()
 		return
 
+# A class to present a shared T_Descendants subtree at a given position in a descendants tree
+# Used in templates in place of T_Descendants
+#
+# The subtrees held in the descendant cache (see Database.GetTDescendants()) have level 1 at the top,
+# so that a subtree can be used wherever its person appears. The view adds the offset of the position
+# to the levels of the subtree and wraps the children in views of their own.
+#
+class T_DescendantsView():
+	__slots__ = ('node', 'level')
+
+	def __init__(self, node, offset):
+		self.node = node					# The T_Descendants object
+		self.level = node.level + offset	# The level of the object in the tree
+		return
+
+	@property
+	def left(self):
+		return self.node.left
+
+	@property
+	def right(self):
+		return self.node.right
+
+	@property
+	def children(self):
+		cc = self.node.children
+		if cc == None or cc == 'private':
+			return cc
+		return [T_DescendantsView(c, self.level) for c in cc]
+
 # A class to hold a row of the event timeline
 # Used in templates
 # See descendant-tree-html.tmpl for details
 #
 class T_Event():
+	__slots__ = ('date', 'evtype', 'tperson', 'information', 'sources')
+
 	def __init__(self, date, etype, tperson):
 		self.date = date		# Formatted date of the event
 		self.evtype = etype		# Event type
@@ -140,8 +261,10 @@ class T_Event():
 # A class to hold an item of information about an event
 #
 class T_EvInfo():
+	__slots__ = ('caption', 'info', 'url', 'moreinfo')
+
 	def __init__(self, caption, info):
-		self.caption = caption		# Type of information (Place, Abode etc.)
+		self.caption = sys.intern(caption)	# Type of information (Place, Abode etc.)
 		self.info = info			# The information (text)
 		self.url = None				# Link to a supporting page
 		self.moreinfo = None		# List of supplementary information (T_EvInfo objects with no moreinfo)
@@ -228,11 +351,14 @@ class T_File():
 # A class to hold a node in the ancestor tree
 #
 class T_AncestorNode():
+	__slots__ = ('level', 'subj', 'rowspan', 'parents', 'collapsed')
+
 	def __init__(self, level, subj):
 		self.level = level		# The level. Level 1 is the top level
 		self.subj = subj		# A T_Person object representing the person at this level
 		self.rowspan = 1		# How many rows of HTML table to occupy
 		self.parents = None		# An array of two elements that can be None or a T_AncestorNode() object
+		self.collapsed = None	# The T_AncestorNode() object with this person's ancestors if already in the tree
 
 	# Get a parent from the parents array.
 	# The index must be 0 or 1
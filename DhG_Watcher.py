@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+#
+# (c) David Haworth
+#
+# This file is part of DhG.
+#
+# DhG is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DhG is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DhG.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+from pathlib import Path
+from DhG_Snapshot import Snapshot
+
+# A class to watch the card files for changes
+#
+# The watcher is a background thread that periodically scans the database directory and compares
+# the signatures (size and modification time) of the card files with those of the previous scan.
+# Polling is used so that no special operating system services are needed.
+#
+# The watcher never modifies the database itself. When a change is detected the new signatures are
+# held until the shell collects them with TakeChanges() between commands and passes them to
+# Database.ReloadChanged(). When the shell reloads card files itself it passes the signatures that
+# the database has loaded to SetSignatures(), so that those files are not reported again.
+#
+# The watcher can be paused, for example while the main process forks worker processes, so that a
+# worker never starts with a copy of the watcher in the middle of a scan.
+#
+class Watcher(threading.Thread):
+	def __init__(self, basepath, interval, sigs):
+		super().__init__(daemon=True)
+		self.basepath = basepath
+		self.interval = interval
+		self.last = sigs				# Signatures from the previous scan
+		self.pending = None				# Signatures of a scan that found changes, not yet collected
+		self.lock = threading.Lock()
+		self.busy = threading.Lock()	# Held during a scan and while the watcher is paused
+		self.stopped = threading.Event()
+		return
+
+	# Scan the database directory every interval seconds until stopped
+	#
+	def run(self):
+		while not self.stopped.wait(self.interval):
+			with self.busy:
+				sigs = {}
+				for path in Path(self.basepath).rglob('*.card'):
+					try:
+						sigs[str(path)] = Snapshot.GetSignature(path)
+					except OSError:
+						sigs[str(path)] = None
+				if sigs != self.last:
+					with self.lock:
+						self.pending = sigs
+					self.last = sigs
+		return
+
+	# Pause the watcher. Waits until the current scan, if any, has finished.
+	#
+	def Pause(self):
+		self.busy.acquire()
+		return
+
+	# Resume the watcher after Pause()
+	#
+	def Resume(self):
+		self.busy.release()
+		return
+
+	# Replace the signatures that the next scan is compared with, for example after the database has
+	# reloaded card files itself. Any changes found but not yet collected are discarded; if they are
+	# not covered by the new signatures, the next scan finds them again.
+	#
+	def SetSignatures(self, sigs):
+		with self.busy:
+			with self.lock:
+				self.pending = None
+			self.last = sigs
+		return
+
+	# Return the signatures of the latest scan if any changes have been found since the last call,
+	# otherwise None
+	#
+	def TakeChanges(self):
+		with self.lock:
+			sigs = self.pending
+			self.pending = None
+		return sigs
+
+	# Stop the watcher. The thread ends at the end of the current interval.
+	#
+	def Stop(self):
+		self.stopped.set()
+		return